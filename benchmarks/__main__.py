@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import typer
+from rich import print
+from rich.table import Table
+
+from benchmarks.solr import FakeSolr
+
+app = typer.Typer(help="i3worker benchmarks")
+
+
+@app.command()
+def main(
+    users: int = 2,
+    folders: int = 100,
+    documents: int = 1000,
+    versions: int = 2,
+    pages: int = 3,
+    text_size: int = 2000,
+    tags: int = 20,
+    tags_per_node: int = 2,
+    seed: int = 42,
+    sample: int = 200,
+    workers: int = 1,
+    memory: bool = True,
+    output: Optional[Path] = None
+):
+    """Runs tasks and `i3 index` on synthetic corpus against fake Solr
+
+    `--sample` - number of nodes/versions processed by the benchmarks of
+     the tasks which handle one node/version per call
+    `--workers` - number of `i3 index` processes (queries of
+     worker processes are not counted)
+    `--no-memory` - do not trace peak memory (tracing slows down Python
+     code, thus timings are not comparable with runs with tracing)
+    `--output` - write results to given file as JSON
+    """
+    logging.basicConfig(level=logging.WARNING)
+    solr = FakeSolr()
+    solr.start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # settings are read on import, thus environment must be set
+        # before any i3worker module is imported
+        os.environ.update(
+            PAPERMERGE__SEARCH__URL=solr.url(),
+            PAPERMERGE__DATABASE__URL=f"sqlite:///{tmp_dir}/bench.sqlite3",
+            PAPERMERGE__INDEX__STATE_DIR=tmp_dir,
+            PAPERMERGE__COALESCE__WINDOW="0"
+        )
+        os.environ.pop("PAPERMERGE__INDEX__FINGERPRINTS", None)
+        from benchmarks import suite
+        from benchmarks.corpus import CorpusConfig
+
+        config = CorpusConfig(
+            users=users,
+            folders=folders,
+            documents=documents,
+            versions=versions,
+            pages=pages,
+            text_size=text_size,
+            tags=tags,
+            tags_per_node=tags_per_node,
+            seed=seed
+        )
+        results = suite.run(
+            solr,
+            config,
+            sample=sample,
+            workers=workers,
+            trace_memory=memory
+        )
+    solr.stop()
+
+    table = Table(title=f"{config}")
+    for column in (
+        "benchmark", "entities", "seconds", "entities/s", "CPU µs/entity",
+        "queries/entity", "requests", "KiB sent", "peak MiB"
+    ):
+        table.add_column(column, justify="left" if column == "benchmark" else "right")
+    for result in results:
+        table.add_row(
+            result.name,
+            str(result.entities),
+            f"{result.seconds:.3f}",
+            f"{result.entities_per_second:.0f}",
+            f"{result.cpu_us_per_entity:.0f}",
+            f"{result.queries_per_entity:.3f}",
+            str(result.requests),
+            f"{result.bytes / 1024:.0f}",
+            "-" if result.peak_memory is None
+            else f"{result.peak_memory / 2**20:.1f}"
+        )
+    print(table)
+
+    if output:
+        data = {
+            "config": config.__dict__,
+            "results": [result.as_dict() for result in results]
+        }
+        output.write_text(json.dumps(data, indent=2))
+
+
+if __name__ == "__main__":
+    app()
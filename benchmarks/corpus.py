@@ -0,0 +1,176 @@
+import random
+import uuid
+from dataclasses import dataclass, field
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from i3worker.db.base import Base
+from i3worker.db.orm import (
+    Document,
+    DocumentVersion,
+    Folder,
+    NodeTagsAssociation,
+    Page,
+    Tag,
+    User
+)
+
+WORDS = (
+    "invoice receipt contract total amount payment due date tax account "
+    "bank transfer order delivery address customer number reference "
+    "insurance policy claim salary statement balance period service"
+).split()
+# max number of rows inserted with one statement
+INSERT_CHUNK_SIZE = 1000
+
+
+@dataclass
+class CorpusConfig:
+    users: int = 2
+    folders: int = 100
+    documents: int = 1000
+    versions: int = 2  # per document
+    pages: int = 3  # per document version
+    text_size: int = 2000  # characters of OCR text per page
+    tags: int = 20
+    tags_per_node: int = 2
+    seed: int = 42
+
+
+@dataclass
+class Corpus:
+    folder_ids: list[uuid.UUID] = field(default_factory=list)
+    document_ids: list[uuid.UUID] = field(default_factory=list)
+    # (last version ID, previous version ID) of each document
+    version_pairs: list[tuple[uuid.UUID, uuid.UUID]] = field(
+        default_factory=list
+    )
+    # page IDs of last document versions
+    page_ids: list[uuid.UUID] = field(default_factory=list)
+
+
+def generate(db_session: Session, config: CorpusConfig) -> Corpus:
+    """Creates synthetic corpus in the (empty) database
+
+    Same config (including `seed`) always gives the same corpus.
+    """
+    rng = random.Random(config.seed)
+    corpus = Corpus()
+
+    def new_id() -> uuid.UUID:
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    def text() -> str:
+        words = []
+        size = 0
+        while size < config.text_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+
+        return ' '.join(words)[:config.text_size]
+
+    Base.metadata.create_all(db_session.get_bind())
+
+    users = [
+        dict(
+            id=new_id(),
+            username=f"user{i}",
+            email=f"user{i}@example.com",
+            password="secret"
+        )
+        for i in range(config.users)
+    ]
+    tags = [dict(id=new_id(), name=f"tag{i}") for i in range(config.tags)]
+    _insert(db_session, User, users)
+    _insert(db_session, Tag, tags)
+
+    folders = []
+    for i in range(config.folders):
+        folder_id = new_id()
+        corpus.folder_ids.append(folder_id)
+        folders.append(
+            dict(
+                id=folder_id,
+                ctype="folder",
+                title=f"Folder {i}",
+                lang="en",
+                user_id=rng.choice(users)["id"]
+            )
+        )
+    _insert(db_session, Folder, folders)
+
+    documents = []
+    versions = []
+    pages = []
+    for i in range(config.documents):
+        doc_id = new_id()
+        corpus.document_ids.append(doc_id)
+        documents.append(
+            dict(
+                id=doc_id,
+                ctype="document",
+                title=f"document_{i}.pdf",
+                lang="en",
+                user_id=rng.choice(users)["id"]
+            )
+        )
+        version_ids = []
+        for number in range(1, config.versions + 1):
+            ver_id = new_id()
+            version_ids.append(ver_id)
+            versions.append(
+                dict(
+                    id=ver_id,
+                    number=number,
+                    file_name=f"document_{i}.pdf",
+                    document_id=doc_id
+                )
+            )
+            for page_number in range(1, config.pages + 1):
+                page_id = new_id()
+                pages.append(
+                    dict(
+                        id=page_id,
+                        number=page_number,
+                        text=text(),
+                        document_version_id=ver_id
+                    )
+                )
+                if number == config.versions:
+                    corpus.page_ids.append(page_id)
+        if len(version_ids) > 1:
+            corpus.version_pairs.append((version_ids[-1], version_ids[-2]))
+
+        if len(pages) >= INSERT_CHUNK_SIZE:
+            _insert(db_session, Document, documents)
+            _insert(db_session, DocumentVersion, versions)
+            _insert(db_session, Page, pages)
+            documents, versions, pages = [], [], []
+
+    _insert(db_session, Document, documents)
+    _insert(db_session, DocumentVersion, versions)
+    _insert(db_session, Page, pages)
+
+    node_tags = []
+    node_ids = corpus.folder_ids + corpus.document_ids
+    per_node = min(config.tags_per_node, len(tags))
+    for node_id in node_ids:
+        for tag in rng.sample(tags, per_node):
+            node_tags.append(
+                dict(id=len(node_tags) + 1, node_id=node_id, tag_id=tag["id"])
+            )
+    _insert(db_session, NodeTagsAssociation, node_tags)
+
+    db_session.commit()
+
+    return corpus
+
+
+def _insert(db_session: Session, model, rows: list[dict]):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db_session.execute(
+            insert(model),
+            rows[start:start + INSERT_CHUNK_SIZE]
+        )
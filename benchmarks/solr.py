@@ -0,0 +1,185 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DOCUMENT_ID_QUERY = re.compile(r'"([^"]+)"')
+
+
+class Stats:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.added = 0
+        self.deleted = 0
+        self.commits = 0
+
+    def copy(self) -> 'Stats':
+        stats = Stats()
+        stats.__dict__.update(self.__dict__)
+        return stats
+
+    def __sub__(self, other: 'Stats') -> 'Stats':
+        stats = Stats()
+        for name, value in self.__dict__.items():
+            setattr(stats, name, value - getattr(other, name))
+        return stats
+
+
+class FakeSolr:
+    """In-process stand-in for Solr's update and select API
+
+    Understands request formats used by i3worker: JSON array of docs,
+    JSON update commands (with repeated "add" keys), atomic updates of
+    docs, deletes by ID and by query (`*:*` and `document_id:(...)`),
+    cursor paging over IDs (of all docs or of `document_id:(...)`)
+    and schema requests. Only IDs and document IDs of the docs are kept
+    in memory.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.docs: dict[str, str | None] = {}  # id -> document_id
+        self.stats = Stats()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def url(self, index: str = 'bench') -> str:
+        return f'solr://127.0.0.1:{self.port}/{index}'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, body: bytes, params: dict):
+        # objects are decoded as lists of key/value pairs, as update
+        # commands may have repeated keys
+        data = json.loads(body, object_pairs_hook=lambda pairs: pairs)
+        with self.lock:
+            if body.lstrip().startswith(b'['):
+                # JSON array of docs
+                for doc in data:
+                    self._add(dict(doc))
+            else:
+                for key, value in data:
+                    if key == 'add':
+                        self._add(dict(dict(value)['doc']))
+                    elif key == 'delete':
+                        self._delete(value)
+                    elif key == 'commit':
+                        self.stats.commits += 1
+            if params.get('commit') == ['true']:
+                self.stats.commits += 1
+
+    def select(self, params: dict) -> dict:
+        rows = int(params.get('rows', ['10'])[0])
+        cursor = params.get('cursorMark', ['*'])[0]
+        query = params.get('q', ['*:*'])[0]
+        with self.lock:
+            if query.startswith('document_id:'):
+                document_ids = set(DOCUMENT_ID_QUERY.findall(query))
+                ids = sorted(
+                    doc_id for doc_id, document_id in self.docs.items()
+                    if document_id in document_ids
+                )
+            else:
+                ids = sorted(self.docs)
+        start = 0 if cursor == '*' else int(cursor)
+        page = ids[start:start + rows]
+
+        return {
+            'response': {
+                'numFound': len(ids),
+                'start': start,
+                'docs': [{'id': doc_id} for doc_id in page]
+            },
+            'nextCursorMark': str(start + len(page)) if page else cursor
+        }
+
+    def _add(self, doc: dict):
+        if '_version_' in doc:
+            # atomic update of an existing doc; others are skipped
+            # (i3worker sends them with failOnVersionConflicts=false)
+            if doc['id'] in self.docs:
+                self.stats.added += 1
+            return
+
+        self.docs[doc['id']] = doc.get('document_id')
+        self.stats.added += 1
+
+    def _delete(self, value):
+        # decoded object is list of (key, value) tuples
+        if not value or not isinstance(value[0], tuple):
+            for doc_id in value:
+                if self.docs.pop(doc_id, False) is not False:
+                    self.stats.deleted += 1
+            return
+
+        query = dict(value)['query']
+        if query == '*:*':
+            self.stats.deleted += len(self.docs)
+            self.docs.clear()
+        elif query.startswith('document_id:'):
+            document_ids = set(DOCUMENT_ID_QUERY.findall(query))
+            ids = [
+                doc_id for doc_id, document_id in self.docs.items()
+                if document_id in document_ids
+            ]
+            for doc_id in ids:
+                del self.docs[doc_id]
+            self.stats.deleted += len(ids)
+
+    def _handler(self):
+        solr = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive, as Solr does
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately; with Nagle's
+            # algorithm on, each response would wait for delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                self._count(0)
+                if url.path.endswith('/select'):
+                    self._reply(200, solr.select(parse_qs(url.query)))
+                else:
+                    # e.g. schema field lookups: field does not exist
+                    self._reply(404, {})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                self._count(len(body))
+                if url.path.endswith('/update'):
+                    solr.update(body, parse_qs(url.query))
+                self._reply(200, {'responseHeader': {'status': 0}})
+
+            def _count(self, size: int):
+                with solr.lock:
+                    solr.stats.requests += 1
+                    solr.stats.bytes += size
+
+            def _reply(self, status: int, data: dict):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,204 @@
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Callable
+
+from i3worker import metrics, tasks, utils
+from i3worker.bulk import encode, to_doc
+from i3worker.cli import app as cli
+from i3worker.db.engine import Session
+
+from benchmarks.corpus import Corpus, CorpusConfig, generate
+from benchmarks.solr import FakeSolr
+
+# number of IDs passed to one task by the benchmarks of tasks accepting
+# list of IDs
+TASK_CHUNK_SIZE = 100
+
+
+@dataclass
+class Result:
+    name: str
+    entities: int  # number of entities added to / removed from the index
+    seconds: float
+    cpu_seconds: float  # CPU time of this process
+    queries: int
+    requests: int
+    bytes: int
+    peak_memory: int | None  # bytes; None if memory was not traced
+
+    @property
+    def entities_per_second(self) -> float:
+        return self.entities / self.seconds if self.seconds else 0
+
+    @property
+    def queries_per_entity(self) -> float:
+        return self.queries / self.entities if self.entities else 0
+
+    @property
+    def cpu_us_per_entity(self) -> float:
+        return self.cpu_seconds * 1e6 / self.entities if self.entities else 0
+
+    def as_dict(self) -> dict:
+        return {
+            **asdict(self),
+            'entities_per_second': self.entities_per_second,
+            'queries_per_entity': self.queries_per_entity,
+            'cpu_us_per_entity': self.cpu_us_per_entity
+        }
+
+
+def ids(values: list[uuid.UUID]) -> list[str]:
+    return [str(value) for value in values]
+
+
+def cases(corpus: Corpus, sample: int, workers: int) -> list[tuple]:
+    """Returns list of (name, function) benchmark cases
+
+    Functions which do not send anything to the index return number
+    of entities they processed.
+
+    `flush_index_buffer` is not benchmarked as it requires Redis.
+    """
+    folder_ids = ids(corpus.folder_ids[:sample])
+    document_ids = ids(corpus.document_ids[:sample])
+    version_pairs = corpus.version_pairs[:sample]
+
+    def index_all():
+        jobs = [
+            dict(after_id=after_id, until_id=until_id)
+            for after_id, until_id in (
+                utils.uuid_ranges(workers * 4) if workers > 1
+                else [(None, None)]
+            )
+        ]
+        cli.run_index_jobs(jobs, workers)
+
+    def convert_nodes():
+        # cost of turning database rows into docs ready to be sent,
+        # without sending them
+        count = 0
+        with Session() as db_session:
+            for _, entities in cli.iter_index_chunks(db_session):
+                for entity in entities:
+                    encode(to_doc(entity))
+                count += len(entities)
+        return count
+
+    def convert_pages():
+        count = 0
+        with Session() as db_session:
+            for entity in tasks._page_entities(db_session, ids(corpus.page_ids)):
+                encode(to_doc(entity))
+                count += 1
+        return count
+
+    def add_folders():
+        for folder_id in folder_ids:
+            tasks.index_add_node(folder_id)
+
+    def add_documents():
+        for document_id in document_ids:
+            tasks.index_add_node(document_id)
+
+    def add_docs():
+        for chunk in utils.chunked(ids(corpus.document_ids), TASK_CHUNK_SIZE):
+            tasks.index_add_docs(chunk)
+
+    def add_pages():
+        for chunk in utils.chunked(ids(corpus.page_ids), TASK_CHUNK_SIZE):
+            tasks.add_pages_to_index(chunk)
+
+    def update_versions():
+        for add_ver_id, remove_ver_id in version_pairs:
+            tasks.update_index(str(add_ver_id), str(remove_ver_id))
+
+    def rename_documents():
+        for document_id in document_ids:
+            tasks.rename_node(document_id)
+
+    def update_tags():
+        for chunk in utils.chunked(document_ids, TASK_CHUNK_SIZE):
+            tasks.update_tags(chunk)
+
+    def remove_pages():
+        for chunk in utils.chunked(ids(corpus.page_ids), TASK_CHUNK_SIZE):
+            tasks.remove_folder_or_page_from_index(chunk)
+
+    def remove_docs():
+        for chunk in utils.chunked(ids(corpus.document_ids), TASK_CHUNK_SIZE):
+            tasks.remove_docs_from_index(chunk)
+
+    return [
+        ('convert (nodes)', convert_nodes),
+        ('convert (pages)', convert_pages),
+        ('i3 index', index_all),
+        ('index_add_node (folder)', add_folders),
+        ('index_add_node (document)', add_documents),
+        ('index_add_docs', add_docs),
+        ('add_pages_to_index', add_pages),
+        ('update_index', update_versions),
+        ('rename_node (document)', rename_documents),
+        ('update_tags', update_tags),
+        ('remove_folder_or_page_from_index', remove_pages),
+        ('i3 index (again)', index_all),
+        ('remove_docs_from_index', remove_docs),
+    ]
+
+
+def measure(
+    name: str,
+    func: Callable,
+    solr: FakeSolr,
+    trace_memory: bool
+) -> Result:
+    stats = solr.stats.copy()
+    queries = _query_count()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    processed = func()
+
+    cpu_seconds = time.process_time() - cpu_start
+    seconds = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    diff = solr.stats - stats
+
+    return Result(
+        name=name,
+        entities=diff.added + diff.deleted if processed is None else processed,
+        seconds=seconds,
+        cpu_seconds=cpu_seconds,
+        queries=_query_count() - queries,
+        requests=diff.requests,
+        bytes=diff.bytes,
+        peak_memory=peak_memory
+    )
+
+
+def run(
+    solr: FakeSolr,
+    config: CorpusConfig,
+    sample: int = 200,
+    workers: int = 1,
+    trace_memory: bool = True
+) -> list[Result]:
+    with Session() as db_session:
+        corpus = generate(db_session, config)
+
+    return [
+        measure(name, func, solr, trace_memory)
+        for name, func in cases(corpus, sample, workers)
+    ]
+
+
+def _query_count() -> int:
+    # queries executed in this process only (not in `i3 index` workers)
+    with metrics.db_queries.lock:
+        return int(sum(metrics.db_queries.values.values()))
@@ -1,13 +1,24 @@
 #!/bin/sh
 
+INTERACTIVE_QUEUE=${PAPERMERGE__CELERY__INTERACTIVE_QUEUE:-celery}
+BULK_QUEUE=${PAPERMERGE__CELERY__BULK_QUEUE:-i3worker_bulk}
+
 exec_worker() {
-  echo "now in exec_worker"
-  exec poetry run celery  -A i3worker.celery_app worker ${I3_WORKER_ARGS}
+  # $1 - comma separated queues to consume, in order of preference
+  echo "now in exec_worker (queues: $1)"
+  exec poetry run celery  -A i3worker.celery_app worker -Q "$1" ${I3_WORKER_ARGS}
 }
 
 case $1 in
   worker)
-    exec_worker
+    # both queues, interactive tasks first (unless I3_WORKER_QUEUES is set)
+    exec_worker "${I3_WORKER_QUEUES:-$INTERACTIVE_QUEUE,$BULK_QUEUE}"
+    ;;
+  worker-interactive)
+    exec_worker "$INTERACTIVE_QUEUE"
+    ;;
+  worker-bulk)
+    exec_worker "$BULK_QUEUE"
     ;;
   *)
     exec "$@"
@@ -0,0 +1,515 @@
+import json
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from salinic import IndexRW
+from salinic.field import Field
+from salinic.utils import first
+
+from i3worker import metrics, utils
+from i3worker.config import get_settings
+from i3worker.fingerprint import FingerprintStore, fingerprint
+from i3worker.index import IndexEntity
+
+logger = logging.getLogger(__name__)
+
+# max number of IDs in one delete request
+DELETE_CHUNK_SIZE = 1000
+# max number of document IDs in one query on `document_id` (Solr's
+# default limit of boolean clauses in a query is 1024)
+DOCUMENT_QUERY_CHUNK_SIZE = 500
+
+
+def to_doc(entity: IndexEntity) -> dict:
+    """Returns index entity as dictionary ready to be sent to the index
+
+    Mirrors the transformation salinic's `IndexRW.add` applies before
+    sending the entity to the search engine: multi language fields get
+    language suffix (e.g. 'title' -> 'title_txt_en') and fields with
+    custom index values are replaced by their index value.
+    """
+    doc = entity.model_dump()
+    lang_key = entity.model_config.get('lang_field_name', 'en')
+    for name, multi_lang, needs_transform in _fields(type(entity)):
+        if multi_lang:
+            lang_value = doc[lang_key]
+            doc[f'{name}_txt_{lang_value}'] = doc.pop(name)
+        if needs_transform:
+            orig_value = doc.pop(name)
+            doc[name] = entity.get_field_value(name)
+            doc[f'{name}_orig_'] = json.dumps(orig_value)
+
+    return doc
+
+
+def index_field_name(
+    name: str,
+    lang: str,
+    schema: type[IndexEntity] = IndexEntity
+) -> str:
+    """Returns name under which entity field is stored in the index
+
+    E.g. 'title' -> 'title_txt_en' for multi language fields;
+    see `to_doc`.
+    """
+    for field_name, multi_lang, _ in _fields(schema):
+        if field_name == name and multi_lang:
+            return f'{name}_txt_{lang}'
+
+    return name
+
+
+@lru_cache()
+def _fields(schema: type[IndexEntity]) -> list[tuple[str, bool, bool]]:
+    """Returns (name, is multi language, needs transform) of schema fields
+
+    Field metadata lookups are costly compared to the rest of `to_doc`,
+    thus they are done once per schema instead of once per entity.
+    """
+    result = []
+    for name, field in schema.model_fields.items():
+        field_instance: Field = first(field.metadata)
+        result.append((
+            name,
+            bool(field_instance.multi_lang),
+            hasattr(schema, f'get_idx_value__{name}')
+        ))
+
+    return result
+
+
+class EncodedDoc(NamedTuple):
+    id: str
+    document_id: str | None
+    data: str  # JSON encoded doc
+
+    @property
+    def size(self) -> int:
+        return len(self.data.encode('utf-8'))
+
+
+def encode(doc: dict) -> EncodedDoc:
+    return EncodedDoc(
+        id=doc['id'],
+        document_id=doc.get('document_id'),
+        data=json.dumps(doc)
+    )
+
+
+def batched(
+    docs: Iterable[EncodedDoc],
+    max_count: int,
+    max_bytes: int
+) -> Iterator[list[EncodedDoc]]:
+    """Groups encoded docs in batches
+
+    Each batch has at most `max_count` docs and its total size is at
+    most `max_bytes` - with exception of the docs which alone are
+    larger than `max_bytes`; such docs are yielded as single item
+    batches.
+    """
+    batch = []
+    batch_bytes = 0
+    for doc in docs:
+        size = doc.size
+        if batch and (
+            len(batch) >= max_count or batch_bytes + size > max_bytes
+        ):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(doc)
+        batch_bytes += size
+
+    if batch:
+        yield batch
+
+
+def create_http_session(pool_size: int | None = None) -> requests.Session:
+    """Returns HTTP session which keeps connections to the search engine
+    alive between requests"""
+    pool_size = pool_size or get_settings().papermerge__search__pool_size
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+class BulkIndex:
+    """Adds index entities to the search engine in batches
+
+    Instead of one HTTP request per index entity (which is what
+    `IndexRW.add` does), entities are grouped in batches bounded both by
+    number of entities and by payload size, and each batch is sent
+    to the search engine as one update request.
+
+    If fingerprint store is enabled (`papermerge__index__fingerprints`),
+    entities identical to the ones last sent to the index are skipped.
+    Pass `use_fingerprints=False` to neither consult nor update the store
+    (e.g. when loading an index other than the one it describes).
+
+    With `defer_commit` set, nothing is committed until `commit` is
+    called; useful when loading a collection nobody searches yet.
+    """
+    def __init__(
+        self,
+        index: IndexRW,
+        batch_size: int | None = None,
+        batch_max_bytes: int | None = None,
+        http: requests.Session | None = None,
+        fingerprints: FingerprintStore | None = None,
+        defer_commit: bool = False,
+        use_fingerprints: bool = True
+    ):
+        settings = get_settings()
+        self.index = index
+        self.defer_commit = defer_commit
+        self.client = index.backend.client
+        self.http = http or create_http_session()
+        self.timeout = (
+            settings.papermerge__search__connect_timeout,
+            settings.papermerge__search__read_timeout
+        )
+        self.batch_size = batch_size or settings.papermerge__search__batch_size
+        self.batch_max_bytes = (
+            batch_max_bytes or settings.papermerge__search__batch_max_bytes
+        )
+        self.fingerprints = fingerprints if use_fingerprints else None
+        if (
+            use_fingerprints
+            and fingerprints is None
+            and settings.papermerge__index__fingerprints
+        ):
+            self.fingerprints = FingerprintStore(
+                settings.papermerge__index__fingerprints
+            )
+
+    def add(self, entities: Iterable[IndexEntity], force: bool = False) -> int:
+        """Adds (i.e. inserts or updates) entities to the index
+
+        With `force` set, entities are sent even if they did not change
+        since they were last sent.
+
+        Returns number of entities sent to the index.
+        """
+        count = 0
+        for batch in self.batches(entities, force=force):
+            self.send(batch)
+            self.remember(batch)
+            count += len(batch)
+
+        return count
+
+    def batches(
+        self,
+        entities: Iterable[IndexEntity],
+        force: bool = False
+    ) -> Iterator[list[EncodedDoc]]:
+        """Yields batches of encoded entities which need to be sent
+
+        Unless `force` is set, entities which did not change since they
+        were last sent are left out.
+        """
+        docs = (encode(to_doc(entity)) for entity in entities)
+        if self.fingerprints and not force:
+            docs = self._changed(docs)
+
+        return batched(docs, self.batch_size, self.batch_max_bytes)
+
+    def send(self, batch: list[EncodedDoc], commit: bool = True):
+        """Adds batch of encoded entities to the index
+
+        With `commit` unset, the batch becomes visible only after next
+        commit. Safe to call from multiple threads at once.
+        """
+        logger.debug(f'Adding batch of {len(batch)} entities to index')
+        metrics.index_batch_size.observe(len(batch))
+        self._post(
+            '[' + ','.join(doc.data for doc in batch) + ']',
+            commit=commit
+        )
+
+    def remember(self, batch: list[EncodedDoc]):
+        """Saves fingerprints of the sent batch"""
+        if self.fingerprints:
+            self.fingerprints.save(
+                (doc.id, doc.document_id, fingerprint(doc.data))
+                for doc in batch
+            )
+
+    def update(
+        self,
+        entities: Iterable[IndexEntity],
+        remove_ids: list[str],
+        force: bool = False
+    ) -> int:
+        """Adds entities and removes entities with `remove_ids` at once
+
+        Adds and deletes are sent as one update request, regardless of
+        `batch_size` and `batch_max_bytes`, and committed once, so that
+        searchers see index either before or after the update, never
+        in between (i.e. with both or with none of the added/removed
+        entities). Thus it is meant for replacing a document version;
+        use `add` for large numbers of entities.
+
+        Returns number of entities added to the index.
+        """
+        docs = (encode(to_doc(entity)) for entity in entities)
+        if self.fingerprints and not force:
+            docs = self._changed(docs)
+
+        count = self._send_commands(list(docs), remove_ids, commit=True)
+        self.forget(remove_ids)
+
+        return count
+
+    def set_fields(self, updates: Iterable[tuple[str, dict]]) -> int:
+        """Sets fields of entities already in the index
+
+        `updates` are (entity ID, {index field name: value}) tuples.
+        Uses Solr's atomic updates: only given fields are sent and
+        changed, the rest of the entity (e.g. page text) stays as it
+        is in the index. Updates of entities which are not in the index
+        are skipped (instead of adding entities with given fields only).
+        Updates are sent in batches, all committed with the last one.
+
+        Changed entities no longer match their fingerprints, thus their
+        fingerprints are dropped.
+
+        Returns number of entities updates were sent for.
+        """
+        docs = (
+            EncodedDoc(
+                id=entity_id,
+                document_id=None,
+                data=json.dumps({
+                    'id': entity_id,
+                    # entity must already exist
+                    '_version_': 1,
+                    **{
+                        name: {'set': value}
+                        for name, value in fields.items()
+                    }
+                })
+            )
+            for entity_id, fields in updates
+        )
+        count = 0
+        pending = []
+        for batch in batched(docs, self.batch_size, self.batch_max_bytes):
+            if pending:
+                self._send_updates(pending, commit=False)
+                count += len(pending)
+            pending = batch
+
+        if pending:
+            self._send_updates(pending, commit=True)
+            count += len(pending)
+
+        return count
+
+    def set_document_fields(self, document_ids: list[str], fields: dict) -> int:
+        """Sets fields of all pages of given documents
+
+        Solr has no update by query, thus IDs of the pages are first
+        looked up in the index by their `document_id` - the database
+        is not needed. See `set_fields`.
+
+        Returns number of pages updates were sent for.
+        """
+        ids = (
+            entity_id
+            for chunk in utils.chunked(document_ids, DOCUMENT_QUERY_CHUNK_SIZE)
+            for entity_id in self.iter_ids(query=_document_query(chunk))
+        )
+
+        return self.set_fields((entity_id, fields) for entity_id in ids)
+
+    def remove(self, ids: list[str]) -> int:
+        """Removes entities with given IDs from the index
+
+        IDs are sent in chunks of `DELETE_CHUNK_SIZE`, one request
+        per chunk.
+
+        Returns number of IDs sent to the index.
+        """
+        for chunk in utils.chunked(ids, DELETE_CHUNK_SIZE):
+            logger.debug(f'Removing {len(chunk)} entities from index')
+            self._post(json.dumps({'delete': chunk}))
+        self.forget(ids)
+
+        return len(ids)
+
+    def remove_documents(self, document_ids: list[str]):
+        """Removes all pages of given documents from the index
+
+        Pages are deleted by query on `document_id` field, thus
+        there is no need to know their IDs.
+        """
+        for chunk in utils.chunked(document_ids, DOCUMENT_QUERY_CHUNK_SIZE):
+            logger.debug(f'Removing pages of {len(chunk)} documents')
+            self._post(
+                json.dumps({'delete': {'query': _document_query(chunk)}})
+            )
+
+        if self.fingerprints:
+            self.fingerprints.delete_documents(document_ids)
+
+    def commit(self):
+        """Commits all pending changes"""
+        logger.debug('Committing index')
+        self._post(json.dumps({'commit': {}}), commit=False)
+
+    def iter_ids(self, rows: int = 1000, query: str = '*:*') -> Iterator[str]:
+        """Yields IDs of all entities in the index (or of the entities
+        matching `query`), in ascending order
+
+        Uses Solr's cursor paging, which (unlike paging with `start`)
+        costs the same for the first and for the last page.
+        """
+        cursor = '*'
+        while True:
+            with _instrumented('select'):
+                response = self.http.get(
+                    self.client.http_select_url,
+                    params={
+                        'q': query,
+                        'fl': 'id',
+                        'sort': 'id asc',
+                        'rows': rows,
+                        'cursorMark': cursor
+                    },
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+            result = response.json()
+            docs = result['response']['docs']
+            for doc in docs:
+                yield doc['id']
+
+            next_cursor = result['nextCursorMark']
+            # short page is the last one, no need to ask for the next
+            if next_cursor == cursor or len(docs) < rows:
+                break
+            cursor = next_cursor
+
+    def forget(self, ids: list[str] | None = None):
+        """Drops fingerprints of given entities (of all entities if
+        `ids` is None)
+
+        Must be called whenever entities are removed from the index.
+        """
+        if self.fingerprints is None:
+            return
+
+        if ids is None:
+            self.fingerprints.clear()
+        else:
+            self.fingerprints.delete(ids)
+
+    def _changed(self, docs: Iterable[EncodedDoc]) -> Iterator[EncodedDoc]:
+        """Yields only docs which changed since they were last sent"""
+        for chunk in utils.chunked(docs, self.batch_size):
+            stored = self.fingerprints.get([doc.id for doc in chunk])
+            for doc in chunk:
+                if stored.get(doc.id) != fingerprint(doc.data):
+                    yield doc
+                else:
+                    logger.debug(f'Skipping unchanged entity {doc.id}')
+
+    def _send_commands(
+        self,
+        docs: list[EncodedDoc],
+        remove_ids: list[str] | None = None,
+        commit: bool = True
+    ) -> int:
+        """Sends adds of `docs` and deletes of `remove_ids` in one request
+
+        Uses Solr's JSON update command format, which allows
+        repeated "add" keys, thus the payload is put together
+        as a string.
+        """
+        commands = [f'"add":{{"doc":{doc.data}}}' for doc in docs]
+        if remove_ids:
+            commands.append(f'"delete":{json.dumps(remove_ids)}')
+        if not commands:
+            return 0
+
+        logger.debug(
+            f'Sending {len(docs)} adds and {len(remove_ids or [])} deletes'
+        )
+        metrics.index_batch_size.observe(len(docs))
+        self._post('{' + ','.join(commands) + '}', commit=commit)
+        if self.fingerprints:
+            self.fingerprints.save(
+                (doc.id, doc.document_id, fingerprint(doc.data))
+                for doc in docs
+            )
+
+        return len(docs)
+
+    def _send_updates(self, batch: list[EncodedDoc], commit: bool):
+        logger.debug(f'Sending updates of {len(batch)} entities')
+        metrics.index_batch_size.observe(len(batch))
+        # version conflicts (i.e. entities not in the index) skip
+        # the entity instead of failing the whole request
+        self._post(
+            '[' + ','.join(doc.data for doc in batch) + ']',
+            commit=commit,
+            params={'failOnVersionConflicts': 'false'}
+        )
+        self.forget([doc.id for doc in batch])
+
+    def _post(
+        self,
+        data: str,
+        commit: bool = True,
+        params: dict | None = None
+    ):
+        url = self.client.http_update_url
+        commit = commit and not self.defer_commit
+        payload = data.encode('utf-8')
+        metrics.index_request_bytes.inc(len(payload), operation='update')
+        with _instrumented('update'):
+            response = self.http.post(
+                url,
+                data=payload,
+                params={
+                    'commit': 'true' if commit else 'false',
+                    **(params or {})
+                },
+                headers={'Content-Type': 'application/json'},
+                timeout=self.timeout
+            )
+            if response.status_code == 404:
+                raise ValueError(
+                    f"Index {self.client.http_index_url} not found"
+                )
+            response.raise_for_status()
+
+        return response
+
+
+def _document_query(document_ids: list[str]) -> str:
+    """Returns query matching pages of given documents"""
+    ids = ' OR '.join(f'"{doc_id}"' for doc_id in document_ids)
+
+    return f'document_id:({ids})'
+
+
+@contextmanager
+def _instrumented(operation: str):
+    """Records count, duration and failures of a search engine request"""
+    metrics.index_requests.inc(operation=operation)
+    try:
+        with metrics.index_request_duration.time(operation=operation):
+            yield
+    except Exception:
+        metrics.index_request_failures.inc(operation=operation)
+        raise
@@ -1,7 +1,14 @@
 import yaml
 from celery import Celery
-from i3worker import config, utils
-from celery.signals import setup_logging
+from i3worker import config, constants, metrics, utils
+from i3worker.db import engine
+from celery.signals import (
+    setup_logging,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_ready,
+    worker_shutdown
+)
 from logging.config import dictConfig
 
 
@@ -10,6 +17,8 @@ settings = config.get_settings()
 app = Celery(
     'i3worker',
     broker=settings.papermerge__redis__url,
+    # needed to collect results of chunks of split index_add_docs calls
+    backend=settings.papermerge__redis__url,
     include=['i3worker.tasks']
 )
 
@@ -23,8 +32,23 @@ app.conf.update(
     interval_start=0,
     interval_step=0.2,
     interval_max=0.2,
+    # only tasks which need it (e.g. index_add_docs_chunk) store results
+    task_ignore_result=True,
+    task_default_queue=settings.papermerge__celery__interactive_queue,
+    task_routes={
+        name: {'queue': settings.papermerge__celery__bulk_queue}
+        for name in constants.BULK_TASKS
+    },
+    # worker consuming both queues (`-Q interactive,bulk`) takes tasks
+    # from the first queue as long as there are any
+    broker_transport_options={'queue_order_strategy': 'priority'},
+    # do not let a worker process reserve tasks while it is busy with
+    # a long running (bulk) one
+    worker_prefetch_multiplier=1,
 )
 
+metrics.instrument_celery()
+
 
 @setup_logging.connect
 def config_loggers(*args, **kwags):
@@ -32,5 +56,28 @@ def config_loggers(*args, **kwags):
         utils.setup_logging(settings.papermerge__main__logging_cfg)
 
 
+@worker_process_init.connect
+def init_worker_process(*args, **kwargs):
+    # prefork pool: worker process must not reuse database
+    # and search engine connections opened by the parent process
+    from i3worker import tasks
+    engine.reset_after_fork()
+    tasks.reset_index_after_fork()
+    metrics.start_exporter()
+
+
+@worker_ready.connect
+def init_worker(*args, **kwargs):
+    # solo and threads pools run tasks in the main process
+    metrics.start_exporter()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker(*args, **kwargs):
+    # pool processes exit with os._exit, thus atexit handlers do not run
+    metrics.stop_exporter()
+
+
 if __name__ == '__main__':
     app.start()
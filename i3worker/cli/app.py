@@ -1,15 +1,28 @@
 import logging
+import multiprocessing
 import uuid
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
 import typer
 from rich import print_json, print
+from rich.console import Console
+from rich.table import Table
 from salinic import SchemaManager, create_engine, IndexRW, Search
 from typing_extensions import Annotated
 
 from i3worker.db.engine import Session
-from i3worker import schema, config
+from i3worker import schema, config, utils, verify
+from i3worker.celery_app import app as celery_app
 from i3worker.db import api
-from i3worker.index import FOLDER, PAGE, IndexEntity
+from i3worker.bulk import BulkIndex
+from i3worker.cluster import Collections
+from i3worker.export import NDJSONWriter
+from i3worker.state import IndexState
+from i3worker.index import IndexEntity
+from i3worker.pipeline import StageStats
+from i3worker.tasks import from_nodes, get_index_pipeline
 
 
 app = typer.Typer(help="i3 command line interface")
@@ -30,7 +43,16 @@ NodeIDsType = Annotated[
 def index_cmd(
     node_ids: NodeIDsType = None,
     dry_run: bool = False,
-    rebuild: bool = False
+    rebuild: bool = False,
+    workers: int = 1,
+    since: Optional[datetime] = None,
+    incremental: bool = False,
+    resume: bool = False,
+    force: bool = False,
+    blue_green: bool = False,
+    keep_old: bool = False,
+    concurrency: Optional[int] = None,
+    timings: bool = False
 ):
     """Indexes given nodes. If no nodes are given will index all
     nodes in the database
@@ -38,53 +60,452 @@ def index_cmd(
     `--rebuild` - will drop all documents from the index first, and then
      start indexing the rest of the documents
      `--dry-run`
+     `--workers` - number of processes to index with; node ID space is
+     split in ranges and ranges are indexed in parallel
+     (ignored with `--dry-run`)
+     `--since` - index only nodes updated after given time
+     `--incremental` - index only nodes updated since the start of the last
+     successful run
+     `--resume` - continue interrupted run from where it stopped (use
+     same `--workers` value as the interrupted run)
+     `--force` - send all entities to the index, including the ones which
+     did not change since they were last indexed
+     `--blue-green` - with `--rebuild`, index all nodes in a new collection
+     and then switch the alias (the index name in search URL) to it; the
+     old collection stays searchable until the switch
+     `--keep-old` - with `--blue-green`, do not delete the old collection
+     `--concurrency` - max number of add requests in flight per worker
+     (default: PAPERMERGE__SEARCH__CONCURRENCY)
+     `--timings` - print time spent by each stage of the indexing pipeline
+     (read, convert, batch, write), for each range of node IDs
     """
     logger.debug("index cmd")
-    with Session() as db_session:
-        logger.debug("getting nodes")
-        nodes = api.get_nodes(db_session, node_ids)
-        items = []  # to be added to the index
-        for node in nodes:
-            if isinstance(node, schema.Document):
-                last_ver = api.get_last_version(
-                    db_session,
-                    doc_id=node.id
-                )
-                pages = api.get_pages(db_session, last_ver.id)
-                for page in pages:
-                    item = IndexEntity(
-                        id=str(page.id),
-                        title=node.title,
-                        user_id=str(node.user_id),
-                        document_id=str(node.id),
-                        document_version_id=str(last_ver.id),
-                        page_number=page.number,
-                        text=page.text,
-                        entity_type=PAGE,
-                        tags=[tag.name for tag in node.tags],
-                    )
-                    items.append(item)
-            else:
-                item = IndexEntity(
-                    id=str(node.id),
-                    title=node.title,
-                    user_id=str(node.user_id),
-                    entity_type=FOLDER,
-                    tags=[tag.name for tag in node.tags],
-                )
-                items.append(item)
+    if blue_green:
+        if not rebuild or node_ids or since or incremental or resume:
+            raise typer.BadParameter(
+                "--blue-green can be used only with --rebuild "
+                "(and without node IDs, --since, --incremental and --resume)"
+            )
+        if dry_run:
+            raise typer.BadParameter(
+                "--blue-green cannot be used with --dry-run"
+            )
+        rebuild_blue_green(workers, keep_old=keep_old, concurrency=concurrency)
+        return
+
+    state = IndexState(settings.papermerge__index__state_dir)
+    if incremental and since is None:
+        since = state.get_watermark()
+        logger.debug(f"incremental index since {since}")
 
     if dry_run:
-        for item in items:
-            print_json(data=item.model_dump())
+        with Session() as db_session:
+            for item in iter_index_entities(db_session, node_ids, since=since):
+                print_json(data=item.model_dump())
+        return
+
+    # progress is tracked only when indexing all (or all updated) nodes
+    track_progress = not node_ids
+    run = state.get_run() if resume and track_progress else None
+    if run:
+        started_at, since = run
+        print(f"Resuming run started at {started_at}")
+    elif track_progress:
+        with Session() as db_session:
+            started_at = api.get_db_time(db_session)
+        state.start_run(started_at, since)
+
+    if rebuild and not run:
+        # drop all documents from the index
+        index.remove(query="*:*")
+        BulkIndex(index).forget()
+
+    if workers > 1:
+        # more ranges than workers, so that workers which are done early
+        # can pick up remaining ranges
+        ranges = utils.uuid_ranges(workers * 4)
     else:
-        if rebuild:
-            # drop all documents from the index
-            index.remove(query="*:*")
-        logger.debug("adding items")
-        for item in items:
-            logger.debug(f"adding item {item}")
-            index.add(item)
+        ranges = [(None, None)]
+
+    jobs = []
+    for after_id, until_id in ranges:
+        resume_after = None
+        if run:
+            resume_after = state.get_checkpoint(after_id, until_id)
+        jobs.append(
+            dict(
+                node_ids=node_ids,
+                after_id=after_id,
+                until_id=until_id,
+                since=since,
+                resume_after=resume_after,
+                checkpoint=track_progress,
+                force=force,
+                concurrency=concurrency,
+                timings=timings
+            )
+        )
+
+    total, failed = run_index_jobs(jobs, workers)
+    print(f"Indexed {total} items in {len(ranges)} ranges")
+    if failed:
+        for job in failed:
+            print(
+                f"[red]Failed range: "
+                f"({job['after_id']}, {job['until_id']}][/red]"
+            )
+        raise typer.Exit(code=1)
+
+    if track_progress:
+        state.finish_run()
+
+
+def rebuild_blue_green(
+    workers: int,
+    keep_old: bool = False,
+    concurrency: int | None = None
+):
+    """Rebuilds the index in a new collection and switches alias to it
+
+    Index name in search URL must be an alias of a collection. New
+    collection is created with the config set, number of shards and
+    replication factor of the current one, and loaded with commits
+    deferred until all nodes are indexed. Then the alias is switched
+    to it, nodes updated while it was loaded are indexed once more
+    and the old collection is deleted.
+
+    Nodes deleted while new collection was loaded may still be in it;
+    run `i3 verify --repair` to remove them.
+    """
+    collections = Collections(index)
+    alias = engine.url.index
+    current = collections.aliases().get(alias)
+    if current is None or ',' in current:
+        print(
+            f"[red]Index {alias} is not an alias of exactly one "
+            "collection[/red]"
+        )
+        raise typer.Exit(code=1)
+
+    status = collections.status(current)
+    with Session() as db_session:
+        started_at = api.get_db_time(db_session)
+    target = f"{alias}_{started_at:%Y%m%d%H%M%S}"
+    print(f"Creating collection {target}")
+    collections.create(
+        target,
+        config_name=status['configName'],
+        num_shards=len(status['shards']),
+        replication_factor=int(status.get('replicationFactor', 1))
+    )
+    target_index = get_collection_index(target)
+    SchemaManager(target_index.engine, model=IndexEntity).apply()
+
+    ranges = utils.uuid_ranges(workers * 4) if workers > 1 else [(None, None)]
+    jobs = [
+        dict(
+            after_id=after_id,
+            until_id=until_id,
+            collection=target,
+            force=True,
+            defer_commit=True,
+            concurrency=concurrency
+        )
+        for after_id, until_id in ranges
+    ]
+    total, failed = run_index_jobs(jobs, workers)
+    if failed:
+        print(f"[red]Failed to load {target}, deleting it[/red]")
+        collections.delete(target)
+        BulkIndex(index).forget()
+        raise typer.Exit(code=1)
+
+    BulkIndex(target_index).commit()
+    collections.create_alias(alias, target)
+    print(f"Indexed {total} items, switched {alias} from {current} to {target}")
+
+    # fingerprints describe content of the old collection
+    BulkIndex(index).forget()
+    count, failed = run_index_jobs([dict(since=started_at, force=True)], 1)
+    if failed:
+        print(
+            f"[red]Failed to index nodes updated since {started_at}; "
+            f"run `i3 index --since '{started_at}'`[/red]"
+        )
+        raise typer.Exit(code=1)
+    print(f"Indexed {count} items updated during rebuild")
+    IndexState(settings.papermerge__index__state_dir).set_watermark(
+        started_at
+    )
+
+    if not keep_old:
+        collections.delete(current)
+        print(f"Deleted collection {current}")
+
+
+def get_collection_index(collection: str | None = None) -> IndexRW:
+    """Returns index of given collection (default: index in search URL)"""
+    if collection is None:
+        return index
+
+    url = engine.url.model_copy(update={'index': collection})
+    return IndexRW(create_engine(url), schema=IndexEntity)
+
+
+def index_nodes(
+    node_ids: list[uuid.UUID] | None = None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    since: datetime | None = None,
+    resume_after: uuid.UUID | None = None,
+    checkpoint: bool = False,
+    force: bool = False,
+    collection: str | None = None,
+    defer_commit: bool = False,
+    concurrency: int | None = None,
+    timings: bool = False
+) -> int:
+    """Indexes nodes with IDs in (after_id, until_id] range
+
+    If `resume_after` is given, nodes with IDs up to (including)
+    `resume_after` are skipped. With `checkpoint` set, ID of the last
+    indexed node is persisted after each chunk of nodes is sent to
+    the index. Nodes are indexed in `collection` if given, otherwise in
+    the index from search URL; fingerprint store describes the latter,
+    so it is not used for `collection`. Up to `concurrency` add requests
+    are in flight at once.
+
+    Returns number of index entities sent to the index.
+    """
+    state = IndexState(settings.papermerge__index__state_dir)
+    bulk_index = BulkIndex(
+        get_collection_index(collection),
+        defer_commit=defer_commit,
+        use_fingerprints=collection is None
+    )
+    pipeline = get_index_pipeline(bulk_index)
+    if concurrency:
+        pipeline.writers = concurrency
+
+    def save_checkpoint(last_id: uuid.UUID):
+        state.save_checkpoint(after_id, until_id, last_id)
+
+    with Session() as db_session:
+        chunks = iter_node_chunks(
+            db_session,
+            node_ids,
+            after_id=resume_after or after_id,
+            until_id=until_id,
+            since=since
+        )
+        count = pipeline.add(
+            chunks,
+            force=force,
+            on_chunk_done=save_checkpoint if checkpoint else None
+        )
+
+    if timings:
+        print_stage_stats(f"({after_id}, {until_id}]", pipeline.stats)
+
+    return count
+
+
+def print_stage_stats(title: str, stats: list[StageStats]):
+    table = Table(title=title)
+    for column in (
+        "stage", "workers", "items", "busy s", "starved s", "blocked s",
+        "utilization"
+    ):
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    for stage in stats:
+        table.add_row(
+            stage.name,
+            str(stage.workers),
+            str(stage.items),
+            f"{stage.busy:.2f}",
+            f"{stage.starved:.2f}",
+            f"{stage.blocked:.2f}",
+            f"{stage.utilization:.0%}"
+        )
+    print(table)
+
+
+def run_index_jobs(jobs: list[dict], workers: int) -> tuple[int, list[dict]]:
+    """Runs `index_nodes` with each of given keyword arguments
+
+    With more than one worker, jobs run in a pool of `workers` processes.
+    Worker processes are spawned (not forked) so that each one of
+    them creates its own database engine and index client.
+
+    Returns total number of indexed items and list of failed jobs.
+    """
+    total = 0
+    failed = []
+    if workers <= 1:
+        for job in jobs:
+            try:
+                total += index_nodes(**job)
+            except Exception as ex:
+                logger.exception(ex)
+                failed.append(job)
+
+        return total, failed
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(index_nodes, **job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                total += future.result()
+            except Exception as ex:
+                logger.exception(ex)
+                failed.append(futures[future])
+
+    return total, failed
+
+
+def iter_node_chunks(
+    db_session,
+    node_ids: list[uuid.UUID] | None = None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    since: datetime | None = None
+) -> Iterator[tuple[uuid.UUID, list[schema.Document | schema.Folder]]]:
+    """Yields given nodes (or all nodes) chunk by chunk
+
+    Each chunk is yielded as tuple (ID of the last node in the
+    chunk, nodes in the chunk).
+    """
+    nodes = api.iter_nodes(
+        db_session,
+        node_ids,
+        after_id=after_id,
+        until_id=until_id,
+        since=since
+    )
+    for chunk in utils.chunked(nodes, api.CHUNK_SIZE):
+        yield chunk[-1].id, chunk
+
+
+def iter_index_chunks(
+    db_session,
+    node_ids: list[uuid.UUID] | None = None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    since: datetime | None = None
+) -> Iterator[tuple[uuid.UUID, list[IndexEntity]]]:
+    """Yields index entities of given nodes (or of all nodes) chunk by chunk
+
+    Each chunk is yielded as tuple (ID of the last node in the
+    chunk, index entities of the nodes in the chunk).
+    """
+    chunks = iter_node_chunks(
+        db_session,
+        node_ids,
+        after_id=after_id,
+        until_id=until_id,
+        since=since
+    )
+    for last_id, nodes in chunks:
+        yield last_id, from_nodes(db_session, nodes)
+
+
+def iter_index_entities(
+    db_session,
+    node_ids: list[uuid.UUID] | None = None,
+    after_id: uuid.UUID | None = None,
+    until_id: uuid.UUID | None = None,
+    since: datetime | None = None
+) -> Iterator[IndexEntity]:
+    """Yields index entities of given nodes (or of all nodes)"""
+    chunks = iter_index_chunks(
+        db_session,
+        node_ids,
+        after_id=after_id,
+        until_id=until_id,
+        since=since
+    )
+    for _, items in chunks:
+        yield from items
+
+
+@app.command(name="export")
+def export_cmd(
+    node_ids: NodeIDsType = None,
+    output: Annotated[Optional[Path], typer.Option("--output", "-o")] = None,
+    compress: Annotated[bool, typer.Option("--gzip")] = False,
+    max_bytes: int = 0,
+    since: Optional[datetime] = None,
+    incremental: bool = False
+):
+    """Exports index entities of given nodes (or of all nodes) as
+    newline delimited JSON
+
+    Each line is one doc as it would be sent to the search engine.
+
+    `--output` - file to write to (default: stdout)
+    `--gzip` - compress output (`.gz` suffix is added to file name)
+    `--max-bytes` - split output in parts of at most given (uncompressed)
+     size; parts are numbered e.g. export-00001.ndjson
+    `--since` - export only nodes updated after given time
+    `--incremental` - export only nodes updated since the start of the last
+     successful `i3 index` run
+    """
+    # stdout may be the export itself
+    console = Console(stderr=True)
+    if incremental and since is None:
+        since = IndexState(settings.papermerge__index__state_dir).get_watermark()
+
+    writer = NDJSONWriter(output, compress=compress, max_bytes=max_bytes)
+    with Session() as db_session, writer:
+        writer.write(iter_index_entities(db_session, node_ids, since=since))
+
+    console.print(f"Exported {writer.count} items")
+    for path in writer.paths:
+        console.print(f"  {path}")
+
+
+@app.command(name="verify")
+def verify_cmd(repair: bool = False, verbose: bool = False):
+    """Compares the index with the database
+
+    Reports entities missing in the index (folders and pages of last
+    document versions) and entities in the index which are not in the
+    database (orphaned).
+
+    `--repair` - enqueue tasks which add missing and remove orphaned
+     entities
+    `--verbose` - print ID of each missing and orphaned entity
+    """
+    bulk_index = BulkIndex(index)
+    counts = {verify.MISSING: 0, verify.ORPHANED: 0}
+    fix = verify.Repair(celery_app.send_task) if repair else None
+
+    # each stream has its own session, as both are read at the same time
+    with Session() as folders_session, Session() as pages_session:
+        entries = verify.db_entries(
+            api.iter_folder_ids(folders_session),
+            api.iter_last_version_page_ids(pages_session)
+        )
+        for difference in verify.diff(entries, bulk_index.iter_ids()):
+            counts[difference.status] += 1
+            if verbose:
+                print(
+                    f"{difference.status} {difference.id} "
+                    f"{difference.entity_type or ''}"
+                )
+            if fix:
+                fix.push(difference)
+
+    if fix:
+        fix.flush()
+
+    print(
+        f"Missing: {counts[verify.MISSING]}, "
+        f"orphaned: {counts[verify.ORPHANED]}"
+    )
+    if not repair and any(counts.values()):
+        raise typer.Exit(code=1)
 
 
 @app.command(name="config")
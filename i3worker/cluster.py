@@ -0,0 +1,79 @@
+import logging
+
+import requests
+from salinic import IndexRW
+
+from i3worker.bulk import create_http_session
+from i3worker.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class Collections:
+    """Client of Solr's (SolrCloud) Collections API
+
+    Used by blue/green rebuild: index is rebuilt in a fresh collection
+    and then the alias, which is used as index name by all search
+    clients, is switched to it.
+    """
+    def __init__(self, index: IndexRW, http: requests.Session | None = None):
+        settings = get_settings()
+        # http index url is e.g. http://localhost:8983/solr/papermerge
+        base_url = index.backend.client.http_index_url.rsplit('/', 1)[0]
+        self.url = f'{base_url}/admin/collections'
+        self.http = http or create_http_session()
+        self.timeout = (
+            settings.papermerge__search__connect_timeout,
+            settings.papermerge__search__read_timeout
+        )
+
+    def aliases(self) -> dict[str, str]:
+        """Returns mapping alias name -> collection name(s)"""
+        return self._call('LISTALIASES').get('aliases', {})
+
+    def status(self, collection: str) -> dict:
+        """Returns cluster state of the collection
+
+        Among others, state includes `configName`, `shards` and
+        `replicationFactor` of the collection.
+        """
+        result = self._call('CLUSTERSTATUS', collection=collection)
+        return result['cluster']['collections'][collection]
+
+    def create(
+        self,
+        name: str,
+        config_name: str,
+        num_shards: int = 1,
+        replication_factor: int = 1
+    ):
+        self._call(
+            'CREATE',
+            name=name,
+            numShards=num_shards,
+            replicationFactor=replication_factor,
+            **{'collection.configName': config_name}
+        )
+
+    def create_alias(self, alias: str, collection: str):
+        """Points alias to the collection
+
+        If alias already exists, it is switched to the collection
+        atomically, i.e. searches go either to the old or to the new
+        collection.
+        """
+        self._call('CREATEALIAS', name=alias, collections=collection)
+
+    def delete(self, name: str):
+        self._call('DELETE', name=name)
+
+    def _call(self, action: str, **params) -> dict:
+        logger.debug(f'Collections API {action} {params}')
+        response = self.http.get(
+            self.url,
+            params={'action': action, 'wt': 'json', **params},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        return response.json()
@@ -0,0 +1,97 @@
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+NODES = 'nodes'
+PAGES = 'pages'
+VERSIONS = 'versions'
+KINDS = (NODES, PAGES, VERSIONS)
+
+
+class IndexBuffer:
+    """Collects IDs of entities to be (re)indexed
+
+    Indexing events often come in bursts: e.g. when user edits a
+    document, several `index_add_node`, `index_add_pages` and
+    `index_update` messages referring to the same node arrive within
+    a second. Instead of processing each of them independently, their
+    IDs are pushed to redis sets (which deduplicates them) and processed
+    together by a flush task which runs `window` seconds after the first
+    ID was pushed.
+
+    Buffer is shared by all worker processes.
+    """
+    def __init__(
+        self,
+        client: redis.Redis,
+        window: float,
+        max_batch: int,
+        prefix: str = 'i3worker:buffer'
+    ):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self.prefix = prefix
+
+    def push(self, kind: str, values: list[str]) -> bool:
+        """Pushes values to the buffer
+
+        Returns True if caller is expected to schedule the flush task
+        i.e. if there is no flush task scheduled yet.
+        """
+        pipe = self.client.pipeline()
+        pipe.sadd(self._key(kind), *values)
+        # flush key expires eventually so that a lost flush task
+        # does not prevent scheduling of the next ones
+        pipe.set(
+            self._flush_key,
+            1,
+            nx=True,
+            px=int((self.window + 60) * 1000)
+        )
+        _, schedule_flush = pipe.execute()
+
+        return bool(schedule_flush)
+
+    def pop(self) -> dict[str, list[str]]:
+        """Removes and returns at most `max_batch` values of each kind"""
+        # values pushed from now on will need another flush
+        self.client.delete(self._flush_key)
+        pipe = self.client.pipeline()
+        for kind in KINDS:
+            pipe.spop(self._key(kind), self.max_batch)
+
+        result = {}
+        for kind, values in zip(KINDS, pipe.execute()):
+            result[kind] = [value.decode('utf-8') for value in values or []]
+
+        return result
+
+    def restore(self, items: dict[str, list[str]]):
+        """Pushes back values returned by `pop` which were not processed
+        (e.g. because the flush failed)
+
+        Values are processed by the next flush.
+        """
+        pipe = self.client.pipeline()
+        for kind in KINDS:
+            if items.get(kind):
+                pipe.sadd(self._key(kind), *items[kind])
+        pipe.execute()
+
+    def pending(self) -> bool:
+        """Returns True if there are values left in the buffer"""
+        pipe = self.client.pipeline()
+        for kind in KINDS:
+            pipe.scard(self._key(kind))
+
+        return any(pipe.execute())
+
+    def _key(self, kind: str) -> str:
+        return f'{self.prefix}:{kind}'
+
+    @property
+    def _flush_key(self) -> str:
+        return f'{self.prefix}:flush'
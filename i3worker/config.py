@@ -8,6 +8,60 @@ class Settings(BaseSettings):
     papermerge__redis__url: str | None = None
     papermerge__main__logging_cfg: Path | None = None
     papermerge__database__url: str = 'sqlite:////db/db.sqlite3'
+    # number of connections kept open in the pool; 0 disables pooling
+    # (i.e. each session opens a new connection)
+    papermerge__database__pool_size: int = 5
+    papermerge__database__max_overflow: int = 10
+    # seconds after which pooled connection is replaced with a new one
+    papermerge__database__pool_recycle: int = 3600
+    papermerge__database__pool_pre_ping: bool = True
+    # seconds during which index_add_node, index_add_pages and index_update
+    # events are collected and then processed together; 0 disables
+    # coalescing (requires papermerge__redis__url)
+    papermerge__coalesce__window: float = 0
+    # max number of IDs (of each kind) processed by one flush
+    papermerge__coalesce__max_batch: int = 500
+    # where `i3 index` keeps its watermark and checkpoints
+    papermerge__index__state_dir: Path = Path.home() / '.i3worker'
+    # SQLite file with fingerprints of indexed entities; when set, entities
+    # which did not change since they were last indexed are not sent again.
+    # All workers writing to the same index must share this file.
+    papermerge__index__fingerprints: Path | None = None
+    # max number of index entities sent to the search engine in one request
+    papermerge__search__batch_size: int = 100
+    # max size (in bytes) of one bulk request payload
+    papermerge__search__batch_max_bytes: int = 4 * 1024 * 1024
+    # max number of kept alive HTTP connections to the search engine
+    papermerge__search__pool_size: int = 10
+    # max number of add requests in flight when indexing many entities
+    # (`i3 index`, index_add_docs) i.e. number of threads of the pipeline's
+    # write stage
+    papermerge__search__concurrency: int = 4
+    # number of threads (each with its own database session) of the
+    # pipeline's convert stage
+    papermerge__pipeline__converters: int = 2
+    # max number of items waiting between two stages of the pipeline
+    papermerge__pipeline__queue_size: int = 4
+    # timeouts (in seconds) of HTTP requests to the search engine
+    papermerge__search__connect_timeout: float = 5
+    papermerge__search__read_timeout: float = 120
+    # metrics of the main worker process are served over HTTP on this
+    # port, of pool process number <slot> on port + 1 + <slot>
+    papermerge__metrics__port: int | None = None
+    # directory for node exporter's textfile collector; each worker
+    # process writes its metrics to i3worker-<main|slot>.prom file
+    papermerge__metrics__textfile_dir: Path | None = None
+    # seconds between two writes of the metrics file
+    papermerge__metrics__interval: float = 15
+    # queue of the tasks users wait for (e.g. index_add_node); Celery's
+    # default queue, thus tasks sent without queue end up here
+    papermerge__celery__interactive_queue: str = 'celery'
+    # queue of mass indexing tasks (e.g. index_add_docs_bulk)
+    papermerge__celery__bulk_queue: str = 'i3worker_bulk'
+    # index_add_docs calls with more documents are split in chunks of
+    # this many documents, indexed by all workers in parallel; 0 disables
+    # splitting
+    papermerge__celery__chunk_size: int = 500
 
 
 @lru_cache()
@@ -2,4 +2,30 @@ INDEX_ADD_NODE = 'index_add_node'
 INDEX_ADD_DOCS = 'index_add_docs'
 INDEX_ADD_PAGES = 'index_add_pages'
 INDEX_REMOVE_NODE = 'index_remove_node'
+INDEX_REMOVE_DOCS = 'index_remove_docs'
 INDEX_UPDATE = 'index_update'
+INDEX_FLUSH = 'index_flush'
+INDEX_UPDATE_TAGS = 'index_update_tags'
+INDEX_RENAME_TAG = 'index_rename_tag'
+INDEX_RENAME_NODE = 'index_rename_node'
+
+# variants of the tasks for mass indexing, routed to the bulk queue
+INDEX_ADD_DOCS_BULK = 'index_add_docs_bulk'
+INDEX_ADD_PAGES_BULK = 'index_add_pages_bulk'
+# chunks of split index_add_docs call and the task called once they
+# are all done
+INDEX_ADD_DOCS_CHUNK = 'index_add_docs_chunk'
+INDEX_ADD_DOCS_DONE = 'index_add_docs_done'
+
+# tasks consumed from the bulk queue; all other tasks go to
+# the interactive queue
+BULK_TASKS = (
+    INDEX_ADD_DOCS_BULK,
+    INDEX_ADD_PAGES_BULK,
+    INDEX_ADD_DOCS_CHUNK,
+    INDEX_ADD_DOCS_DONE,
+    INDEX_RENAME_TAG,
+)
+# priority of the bulk tasks; with Redis broker 0 is the highest
+# and 9 the lowest priority
+BULK_PRIORITY = 9
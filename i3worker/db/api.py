@@ -1,12 +1,20 @@
 from uuid import UUID
-from typing import Sequence
-from sqlalchemy import select
+from datetime import datetime
+from collections import defaultdict
+from typing import Iterator, Sequence
+from sqlalchemy import Row, and_, func, select
 from sqlalchemy.orm import selectinload
 
 
 from i3worker import schema
 from i3worker.db.engine import Session
-from i3worker.db.orm import (Node, Tag, Document, DocumentVersion, Page)
+from i3worker.db.orm import (
+    Node, NodeTagsAssociation, Tag, Folder, Document, DocumentVersion, Page
+)
+
+# number of rows read from the database in one go by the functions
+# working on (potentially) large number of entities
+CHUNK_SIZE = 500
 
 
 def get_doc(db_session: Session, doc_id: UUID) -> schema.Document:
@@ -50,6 +58,102 @@ def get_last_version(
     return model_doc_ver
 
 
+def get_last_version_page_rows(
+    db_session: Session,
+    doc_ids: list[UUID]
+) -> Sequence[Row]:
+    """
+    Returns pages of the last version of given documents
+
+    Only the columns needed to build index entities are selected, with
+    one query, and returned as plain rows with attributes `document_id`,
+    `version_number`, `id`, `number` and `text` - no ORM objects nor
+    pydantic models are created, which makes a big difference when
+    indexing many pages. Rows are sorted by page number.
+    """
+    if len(doc_ids) == 0:
+        return []
+
+    last_numbers = _last_version_numbers(doc_ids)
+    stmt = select(
+        DocumentVersion.document_id,
+        DocumentVersion.number.label('version_number'),
+        Page.id,
+        Page.number,
+        Page.text
+    ).join(
+        last_numbers,
+        and_(
+            DocumentVersion.document_id == last_numbers.c.document_id,
+            DocumentVersion.number == last_numbers.c.number
+        )
+    ).join(
+        Page,
+        Page.document_version_id == DocumentVersion.id
+    ).order_by(
+        Page.number.asc()
+    )
+
+    return db_session.execute(stmt).all()
+
+
+def iter_last_version_page_ids(
+    db_session: Session,
+    chunk_size: int = CHUNK_SIZE
+) -> Iterator[UUID]:
+    """
+    Yields, ordered, IDs of the pages of last versions of all documents
+
+    Rows are streamed from the database (server side cursor where
+    supported) in chunks of `chunk_size`, thus session must not be used
+    for other queries while iterating.
+    """
+    last_numbers = _last_version_numbers()
+    stmt = select(Page.id).join(
+        DocumentVersion,
+        Page.document_version_id == DocumentVersion.id
+    ).join(
+        last_numbers,
+        and_(
+            DocumentVersion.document_id == last_numbers.c.document_id,
+            DocumentVersion.number == last_numbers.c.number
+        )
+    ).order_by(
+        Page.id
+    ).execution_options(yield_per=chunk_size)
+
+    yield from db_session.scalars(stmt)
+
+
+def iter_folder_ids(
+    db_session: Session,
+    chunk_size: int = CHUNK_SIZE
+) -> Iterator[UUID]:
+    """
+    Yields, ordered, IDs of all folders
+
+    Same as with `iter_last_version_page_ids`, session must not be used
+    for other queries while iterating.
+    """
+    stmt = select(Folder.id).order_by(
+        Folder.id
+    ).execution_options(yield_per=chunk_size)
+
+    yield from db_session.scalars(stmt)
+
+
+def _last_version_numbers(doc_ids: list[UUID] | None = None):
+    """Subquery of (document_id, number) of the last document versions"""
+    stmt = select(
+        DocumentVersion.document_id,
+        func.max(DocumentVersion.number).label('number')
+    )
+    if doc_ids is not None:
+        stmt = stmt.where(DocumentVersion.document_id.in_(doc_ids))
+
+    return stmt.group_by(DocumentVersion.document_id).subquery()
+
+
 def get_doc_ver(
     db_session: Session,
     id: UUID  # noqa
@@ -88,6 +192,33 @@ def get_pages(
     return list(result)
 
 
+def get_version_page_ids(
+    db_session: Session,
+    doc_ver_ids: list[UUID]
+) -> dict[UUID, list[UUID]]:
+    """
+    Returns IDs of the pages of given document versions
+
+    Returned dictionary is keyed by document version ID, page IDs are
+    sorted by page number. Only IDs are selected (no page text) and all
+    versions are looked up with one query; versions not found in the
+    database (or without pages) are not in the result.
+    """
+    if len(doc_ver_ids) == 0:
+        return {}
+
+    stmt = select(Page.document_version_id, Page.id).where(
+        Page.document_version_id.in_(doc_ver_ids),
+    ).order_by(
+        Page.number.asc()
+    )
+    result = defaultdict(list)
+    for doc_ver_id, page_id in db_session.execute(stmt):
+        result[doc_ver_id].append(page_id)
+
+    return dict(result)
+
+
 def get_page(
     db_session: Session,
     id: UUID,
@@ -101,6 +232,125 @@ def get_page(
     return result
 
 
+def get_page_rows(
+    db_session: Session,
+    page_ids: list[UUID]
+) -> list[Row]:
+    """
+    Returns given pages together with data of their document
+
+    Selects only the columns needed to build index entities, with one
+    query, and returns plain rows with attributes `id`, `number`, `text`,
+    `version_number`, `document_id`, `title` and `user_id`. Rows are in the same order as `page_ids`;
+    IDs of pages not found in the database are skipped.
+    """
+    if len(page_ids) == 0:
+        return []
+
+    stmt = select(
+        Page.id,
+        Page.number,
+        Page.text,
+        DocumentVersion.number.label('version_number'),
+        Node.id.label('document_id'),
+        Node.title,
+        Node.user_id
+    ).join(
+        DocumentVersion,
+        Page.document_version_id == DocumentVersion.id
+    ).join(
+        Node,
+        DocumentVersion.document_id == Node.id
+    ).where(
+        Page.id.in_(page_ids)
+    )
+    found = {row.id: row for row in db_session.execute(stmt)}
+
+    return [found[page_id] for page_id in page_ids if page_id in found]
+
+
+def get_tag_names(
+    db_session: Session,
+    node_ids: list[UUID]
+) -> dict[UUID, list[str]]:
+    """
+    Returns names of the tags of given nodes, keyed by node ID
+
+    Names are sorted; nodes without tags are not in the result.
+    """
+    if len(node_ids) == 0:
+        return {}
+
+    stmt = select(NodeTagsAssociation.node_id, Tag.name).join(
+        Tag,
+        NodeTagsAssociation.tag_id == Tag.id
+    ).where(
+        NodeTagsAssociation.node_id.in_(node_ids)
+    ).order_by(
+        Tag.name
+    )
+    result = defaultdict(list)
+    for node_id, name in db_session.execute(stmt):
+        result[node_id].append(name)
+
+    return dict(result)
+
+
+def get_tagged_node_ids(db_session: Session, tag_id: UUID) -> list[UUID]:
+    """Returns IDs of the nodes tagged with given tag"""
+    stmt = select(NodeTagsAssociation.node_id).where(
+        NodeTagsAssociation.tag_id == tag_id
+    ).order_by(
+        NodeTagsAssociation.node_id
+    )
+
+    return list(db_session.scalars(stmt).all())
+
+
+def get_entity_ids(
+    db_session: Session,
+    node_ids: list[UUID]
+) -> dict[UUID, list[UUID]]:
+    """
+    Returns IDs of the index entities of given nodes, keyed by node ID
+
+    Folder is indexed as one entity with ID of the folder, document as
+    the pages of its last version. Only IDs are selected, with two
+    queries; nodes not found in the database are not in the result.
+    """
+    if len(node_ids) == 0:
+        return {}
+
+    stmt = select(Node.id, Node.ctype).where(Node.id.in_(node_ids))
+    result = {}
+    doc_ids = []
+    for node_id, ctype in db_session.execute(stmt):
+        if ctype == 'folder':
+            result[node_id] = [node_id]
+        else:
+            result[node_id] = []
+            doc_ids.append(node_id)
+
+    if len(doc_ids) == 0:
+        return result
+
+    last_numbers = _last_version_numbers(doc_ids)
+    stmt = select(DocumentVersion.document_id, Page.id).join(
+        last_numbers,
+        and_(
+            DocumentVersion.document_id == last_numbers.c.document_id,
+            DocumentVersion.number == last_numbers.c.number
+        )
+    ).join(
+        Page,
+        Page.document_version_id == DocumentVersion.id
+    )
+    for doc_id, page_id in db_session.execute(stmt):
+        result[doc_id].append(page_id)
+
+    return result
+
+
 def get_node(
     db_session: Session,
     node_id: UUID
@@ -132,18 +382,68 @@ def get_nodes(
     nodes = db_session.scalars(stmt).all()
 
     for node in nodes:
-        if node.ctype == 'folder':
-            items.append(
-                schema.Folder.model_validate(node)
-            )
-        else:
-            items.append(
-                schema.Document.model_validate(node)
-            )
+        items.append(_to_node_model(node))
 
     return items
 
 
+def iter_nodes(
+    db_session: Session,
+    node_ids: list[UUID] | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    after_id: UUID | None = None,
+    until_id: UUID | None = None,
+    since: datetime | None = None
+) -> Iterator[schema.Document | schema.Folder]:
+    """Yields nodes ordered by their ID
+
+    Nodes are read from the database in chunks of `chunk_size` using
+    keyset pagination (`WHERE id > <last id> ORDER BY id LIMIT <chunk_size>`),
+    so that memory usage does not depend on the number of nodes in
+    the database. Because no cursor is kept open between chunks,
+    caller is free to run other queries on the same session while
+    iterating.
+
+    Optionally only nodes with IDs in range (after_id, until_id] and/or
+    nodes updated after `since` are yielded.
+    """
+    last_id = after_id
+    while True:
+        stmt = select(Node).options(
+            selectinload(Node.tags)
+        ).order_by(Node.id).limit(chunk_size)
+
+        if node_ids:
+            stmt = stmt.where(Node.id.in_(node_ids))
+        if until_id is not None:
+            stmt = stmt.where(Node.id <= until_id)
+        if since is not None:
+            stmt = stmt.where(Node.updated_at > since)
+        if last_id is not None:
+            stmt = stmt.where(Node.id > last_id)
+
+        nodes = db_session.scalars(stmt).all()
+        for node in nodes:
+            yield _to_node_model(node)
+
+        if len(nodes) < chunk_size:
+            break
+
+        last_id = nodes[-1].id
+
+
+def get_db_time(db_session: Session) -> datetime:
+    """Returns current time according to the database"""
+    return db_session.scalar(select(func.now()))
+
+
+def _to_node_model(node: Node) -> schema.Document | schema.Folder:
+    if node.ctype == 'folder':
+        return schema.Folder.model_validate(node)
+
+    return schema.Document.model_validate(node)
+
+
 def _get_tags_for(
     colored_tags: Sequence[Tag],
     node_id: UUID
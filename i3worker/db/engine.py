@@ -2,6 +2,7 @@ from sqlalchemy import create_engine, Engine
 from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker
 
+from i3worker import metrics
 from i3worker.config import get_settings
 
 
@@ -15,14 +16,36 @@ if SQLALCHEMY_DATABASE_URL.startswith('sqlite'):
     # sqlite specific connection args
     connect_args = {"check_same_thread": False}
 
+if settings.papermerge__database__pool_size > 0:
+    pool_args = dict(
+        pool_size=settings.papermerge__database__pool_size,
+        max_overflow=settings.papermerge__database__max_overflow,
+        pool_recycle=settings.papermerge__database__pool_recycle,
+        pool_pre_ping=settings.papermerge__database__pool_pre_ping,
+    )
+else:
+    pool_args = dict(poolclass=NullPool)
+
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args=connect_args,
-    poolclass=NullPool,
+    **pool_args
 )
+metrics.instrument_engine(engine)
 
 Session = sessionmaker(engine, expire_on_commit=False)
 
 def get_engine() -> Engine:
     return engine
+
+
+def reset_after_fork():
+    """Discards connections inherited from the parent process
+
+    Connections in the pool must not be shared between processes.
+    Called in child process right after fork; connections are not closed
+    (they still belong to the parent), child process just starts with
+    an empty pool.
+    """
+    engine.dispose(close=False)
@@ -0,0 +1,100 @@
+import gzip
+import sys
+from pathlib import Path
+from typing import BinaryIO, Iterable
+
+from i3worker.bulk import encode, to_doc
+from i3worker.index import IndexEntity
+
+
+class NDJSONWriter:
+    """Writes index entities as newline delimited JSON
+
+    Each line is one doc exactly as it is sent to the search engine
+    (i.e. with language suffixes and transformed values), thus
+    files can be loaded with Solr's `/update/json/docs` endpoint.
+
+    With `max_bytes` set, output is split in parts of at most
+    `max_bytes` (uncompressed) each - except for parts holding
+    a single larger doc. Parts are named after `path` with the part
+    number before the suffix e.g. `export-00001.ndjson.gz`.
+    Without `path`, output goes to stdout and is never split.
+    """
+    def __init__(
+        self,
+        path: Path | None = None,
+        compress: bool = False,
+        max_bytes: int = 0
+    ):
+        self.path = path
+        self.compress = compress
+        self.max_bytes = max_bytes if path else 0
+        self.paths: list[Path] = []
+        self.count = 0
+        self._file: BinaryIO | None = None
+        self._part_bytes = 0
+
+    def write(self, entities: Iterable[IndexEntity]) -> int:
+        """Writes entities; returns number of written entities"""
+        count = 0
+        for entity in entities:
+            line = (encode(to_doc(entity)).data + '\n').encode('utf-8')
+            if self._file is None or (
+                self.max_bytes
+                and self._part_bytes
+                and self._part_bytes + len(line) > self.max_bytes
+            ):
+                self._next_part()
+            self._file.write(line)
+            self._part_bytes += len(line)
+            count += 1
+
+        self.count += count
+        return count
+
+    def close(self):
+        if self._file is None:
+            return
+
+        if self.path is None and not self.compress:
+            # stdout itself stays open
+            self._file.flush()
+        else:
+            # closing GzipFile does not close stdout it writes to
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _next_part(self):
+        self.close()
+        self._part_bytes = 0
+        if self.path is None:
+            self._file = sys.stdout.buffer
+            if self.compress:
+                self._file = gzip.GzipFile(fileobj=self._file, mode='wb')
+            return
+
+        path = self._part_path(len(self.paths) + 1)
+        self.paths.append(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compress:
+            self._file = gzip.open(path, 'wb')
+        else:
+            self._file = open(path, 'wb')
+
+    def _part_path(self, number: int) -> Path:
+        path = self.path
+        if self.compress and path.suffix != '.gz':
+            path = path.with_name(path.name + '.gz')
+        if not self.max_bytes:
+            return path
+
+        # e.g. export.ndjson.gz -> export-00001.ndjson.gz
+        stem, _, suffixes = path.name.partition('.')
+        name = f'{stem}-{number:05d}' + (f'.{suffixes}' if suffixes else '')
+        return path.with_name(name)
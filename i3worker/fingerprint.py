@@ -0,0 +1,101 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from i3worker import utils
+
+# max number of SQL variables used in one query
+CHUNK_SIZE = 500
+
+
+def fingerprint(data: str) -> str:
+    """Returns fingerprint of JSON encoded index entity"""
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class FingerprintStore:
+    """Fingerprints of the index entities last sent to the index
+
+    Fingerprints are kept in local SQLite file, keyed by index
+    entity ID. An entity whose fingerprint matches the stored one
+    has exactly the same content as its copy in the index, thus there
+    is no need to send it again.
+
+    Store is correct only as long as the index is not modified
+    by someone else, i.e. all workers writing to the index must share
+    the same store file.
+
+    Store may be used from several threads at once.
+    """
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # concurrent worker processes on the same host share the file
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            ' id TEXT PRIMARY KEY,'
+            ' document_id TEXT,'
+            ' fingerprint TEXT NOT NULL'
+            ')'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS fingerprints_document_id'
+            ' ON fingerprints (document_id)'
+        )
+        self.conn.commit()
+
+    def get(self, ids: list[str]) -> dict[str, str]:
+        """Returns stored fingerprints of given entity IDs"""
+        result = {}
+        for chunk in utils.chunked(ids, CHUNK_SIZE):
+            placeholders = ','.join('?' * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT id, fingerprint FROM fingerprints'
+                    f' WHERE id IN ({placeholders})',
+                    chunk
+                ).fetchall()
+            result.update(rows)
+
+        return result
+
+    def save(self, items: Iterable[tuple[str, str | None, str]]):
+        """Saves (id, document_id, fingerprint) tuples"""
+        items = list(items)
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO fingerprints'
+                ' (id, document_id, fingerprint) VALUES (?, ?, ?)',
+                items
+            )
+            self.conn.commit()
+
+    def delete(self, ids: list[str]):
+        with self.lock:
+            for chunk in utils.chunked(ids, CHUNK_SIZE):
+                placeholders = ','.join('?' * len(chunk))
+                self.conn.execute(
+                    f'DELETE FROM fingerprints WHERE id IN ({placeholders})',
+                    chunk
+                )
+            self.conn.commit()
+
+    def delete_documents(self, document_ids: list[str]):
+        with self.lock:
+            for chunk in utils.chunked(document_ids, CHUNK_SIZE):
+                placeholders = ','.join('?' * len(chunk))
+                self.conn.execute(
+                    'DELETE FROM fingerprints'
+                    f' WHERE document_id IN ({placeholders})',
+                    chunk
+                )
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM fingerprints')
+            self.conn.commit()
@@ -0,0 +1,389 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from billiard.process import current_process
+from celery.signals import task_failure, task_postrun, task_prerun
+from sqlalchemy import event
+
+from i3worker.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _render_labels(self, key: tuple, extra: dict) -> str:
+        pairs = [*zip(self.labels, key), *extra.items()]
+        if not pairs:
+            return ''
+
+        items = ','.join(
+            f'{name}="{_escape(str(value))}"' for name, value in pairs
+        )
+        return '{' + items + '}'
+
+    def render(self, extra_labels: dict) -> list[str]:
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} {self.type}'
+        ]
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value, extra_labels))
+
+        return lines
+
+    def _render_value(self, key, value, extra_labels) -> list[str]:
+        labels = self._render_labels(key, extra_labels)
+        return [f'{self.name}{labels} {_format(value)}']
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.values:
+                # per bucket counts (last one is +Inf), sum
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0]
+            counts, _ = self.values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key][1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value, extra_labels) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            labels = self._render_labels(
+                key, {**extra_labels, 'le': _format(bound)}
+            )
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = self._render_labels(key, extra_labels)
+        lines.append(f'{self.name}_sum{labels} {_format(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+
+        return lines
+
+
+class Registry:
+    """Metrics of the current process
+
+    Rendered in Prometheus text exposition format, thus no client
+    library is needed.
+    """
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, extra_labels: dict | None = None) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(extra_labels or {}))
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+task_duration = REGISTRY.register(
+    Histogram(
+        'i3worker_task_duration_seconds',
+        'Duration of celery tasks',
+        labels=('task', 'state')
+    )
+)
+task_failures = REGISTRY.register(
+    Counter(
+        'i3worker_task_failures_total',
+        'Number of failed celery tasks',
+        labels=('task',)
+    )
+)
+db_queries = REGISTRY.register(
+    Counter(
+        'i3worker_db_queries_total',
+        'Number of executed database queries',
+        labels=('statement',)
+    )
+)
+db_query_duration = REGISTRY.register(
+    Histogram(
+        'i3worker_db_query_duration_seconds',
+        'Duration of database queries',
+        labels=('statement',)
+    )
+)
+index_requests = REGISTRY.register(
+    Counter(
+        'i3worker_index_requests_total',
+        'Number of requests sent to the search engine',
+        labels=('operation',)
+    )
+)
+index_request_bytes = REGISTRY.register(
+    Counter(
+        'i3worker_index_request_bytes_total',
+        'Size of request payloads sent to the search engine',
+        labels=('operation',)
+    )
+)
+index_request_duration = REGISTRY.register(
+    Histogram(
+        'i3worker_index_request_duration_seconds',
+        'Duration of requests sent to the search engine',
+        labels=('operation',)
+    )
+)
+index_request_failures = REGISTRY.register(
+    Counter(
+        'i3worker_index_request_failures_total',
+        'Number of failed requests sent to the search engine',
+        labels=('operation',)
+    )
+)
+index_batch_size = REGISTRY.register(
+    Histogram(
+        'i3worker_index_batch_size',
+        'Number of index entities sent in one request',
+        buckets=SIZE_BUCKETS
+    )
+)
+
+
+def instrument_engine(engine):
+    """Records count and duration of queries executed by the engine"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, *args):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, *args):
+        start = conn.info['query_start'].pop()
+        kind = statement.lstrip().split(None, 1)[0].upper()
+        db_queries.inc(statement=kind)
+        db_query_duration.observe(time.perf_counter() - start, statement=kind)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get('query_start'):
+            conn.info['query_start'].pop()
+
+
+def instrument_celery():
+    """Records duration and failures of celery tasks"""
+    started = {}
+
+    @task_prerun.connect(weak=False)
+    def on_task_prerun(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+        start = started.pop(task_id, None)
+        if start is not None:
+            task_duration.observe(
+                time.perf_counter() - start,
+                task=task.name,
+                state=state
+            )
+
+    @task_failure.connect(weak=False)
+    def on_task_failure(sender=None, **kwargs):
+        task_failures.inc(task=sender.name)
+
+
+class _Exporter:
+    pid: int | None = None
+    server: ThreadingHTTPServer | None = None
+    path: Path | None = None
+    stopped = threading.Event()
+    lock = threading.Lock()
+
+
+def start_exporter():
+    """Starts exporting metrics of the current process
+
+    Does nothing if neither `papermerge__metrics__port` nor
+    `papermerge__metrics__textfile_dir` is configured, or if exporter
+    of the current process is already started. Metrics inherited from
+    the parent process are discarded.
+
+    Each process is identified by its slot: "main" for the main worker
+    process, the index of the pool process (0, 1, ...) for pool
+    processes. Process replacing an exited pool process takes over its
+    slot, thus its port, file and `process` label.
+    """
+    settings = get_settings()
+    if _Exporter.pid == os.getpid():
+        return
+
+    _Exporter.pid = os.getpid()
+    _Exporter.server = None
+    _Exporter.path = None
+    _Exporter.stopped = threading.Event()
+    REGISTRY.clear()
+    slot = process_slot()
+    if settings.papermerge__metrics__port:
+        port = settings.papermerge__metrics__port
+        _start_http_server(port if slot == 'main' else port + 1 + int(slot))
+    if settings.papermerge__metrics__textfile_dir:
+        _start_textfile_writer(
+            Path(settings.papermerge__metrics__textfile_dir),
+            slot,
+            settings.papermerge__metrics__interval
+        )
+
+
+def stop_exporter():
+    """Stops exporting metrics of the current process
+
+    Removes the metrics file, so that metrics of exited process
+    are not exported any longer.
+    """
+    if _Exporter.pid != os.getpid():
+        return
+
+    with _Exporter.lock:
+        _Exporter.stopped.set()
+        if _Exporter.path is not None:
+            _Exporter.path.unlink(missing_ok=True)
+    if _Exporter.server is not None:
+        _Exporter.server.shutdown()
+        _Exporter.server.server_close()
+    _Exporter.pid = None
+
+
+def process_slot() -> str:
+    """Returns "main" or index of the pool process"""
+    index = getattr(current_process(), 'index', None)
+
+    return 'main' if index is None else str(index)
+
+
+def _start_http_server(port: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header(
+                'Content-Type', 'text/plain; version=0.0.4; charset=utf-8'
+            )
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(('', port), Handler)
+    except OSError as ex:
+        logger.warning(f'Failed to serve metrics on port {port}: {ex}')
+        return
+
+    _Exporter.server = server
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Metrics of process {os.getpid()} on port {port}')
+
+
+def _start_textfile_writer(textfile_dir: Path, slot: str, interval: float):
+    path = textfile_dir / f'i3worker-{slot}.prom'
+    stopped = _Exporter.stopped
+
+    def write():
+        with _Exporter.lock:
+            if stopped.is_set():
+                return
+            textfile_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            # each process has its own file; label keeps series unique
+            tmp_path.write_text(REGISTRY.render({'process': slot}))
+            os.replace(tmp_path, path)
+
+    def loop():
+        while not stopped.wait(interval):
+            try:
+                write()
+            except OSError as ex:
+                logger.warning(f'Failed to write metrics: {ex}')
+
+    _Exporter.path = path
+    write()
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    )
+
+
+def _format(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
@@ -0,0 +1,321 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterable, Iterator
+
+from i3worker.bulk import BulkIndex
+from i3worker.index import IndexEntity
+
+logger = logging.getLogger(__name__)
+
+# marks end of the stream of items in a queue
+_DONE = object()
+# seconds between two checks whether pipeline was aborted
+_POLL_INTERVAL = 0.1
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = 0  # number of processed items
+    busy: float = 0  # seconds spent processing items (sum of all workers)
+    starved: float = 0  # seconds spent waiting for input
+    blocked: float = 0  # seconds spent waiting for room in the output queue
+
+    @property
+    def utilization(self) -> float:
+        """Share of the time workers of the stage were busy"""
+        total = self.busy + self.starved + self.blocked
+        return self.busy / total if total else 0
+
+
+class Stage:
+    """Step of the pipeline
+
+    `func` is called with a resource and an item and returns iterable of
+    output items. Each of `workers` threads enters its own
+    `resource()` context (e.g. database session) and passes it to `func`.
+    """
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any, Any], Iterable],
+        workers: int = 1,
+        resource: Callable[[], AbstractContextManager] = nullcontext
+    ):
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+        self.resource = resource
+        self.stats = StageStats(name, self.workers)
+        self.lock = threading.Lock()
+
+    def add_stats(self, items=0, busy=0, starved=0, blocked=0):
+        with self.lock:
+            self.stats.items += items
+            self.stats.busy += busy
+            self.stats.starved += starved
+            self.stats.blocked += blocked
+
+
+class Pipeline:
+    """Stages running in threads, connected by bounded queues
+
+    Items read from `source` (in a thread of its own, reported as stage
+    "read") flow through the stages; outputs of the last stage are
+    yielded by `run` in the calling thread. Queues between stages hold
+    at most `queue_size` items, thus a slow stage slows down stages
+    before it instead of growing memory, while stages after it wait.
+
+    If any stage fails, the pipeline is stopped and the error is raised
+    by `run`.
+    """
+    def __init__(
+        self,
+        source: Iterable,
+        stages: list[Stage],
+        queue_size: int = 4
+    ):
+        self.source = source
+        self.reader = Stage('read', None)
+        self.stages = stages
+        self.queues = [
+            queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)
+        ]
+        self.aborted = threading.Event()
+        self.error: BaseException | None = None
+
+    @property
+    def stats(self) -> list[StageStats]:
+        return [self.reader.stats] + [stage.stats for stage in self.stages]
+
+    def run(self) -> Iterator:
+        threads = [
+            threading.Thread(target=self._read, name='pipeline-read')
+        ]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for number in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, index, remaining),
+                        name=f'pipeline-{stage.name}-{number}'
+                    )
+                )
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(self.queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        except GeneratorExit:
+            self.aborted.set()
+            raise
+        finally:
+            if self.error is None and not self.aborted.is_set():
+                for thread in threads:
+                    thread.join()
+            else:
+                self.aborted.set()
+
+        if self.error is not None:
+            raise self.error
+
+    def _read(self):
+        try:
+            iterator = iter(self.source)
+            while not self.aborted.is_set():
+                start = time.perf_counter()
+                item = next(iterator, _DONE)
+                self.reader.add_stats(
+                    items=0 if item is _DONE else 1,
+                    busy=time.perf_counter() - start
+                )
+                if item is _DONE:
+                    break
+                self.reader.add_stats(blocked=self._put(self.queues[0], item))
+            self._put(self.queues[0], _DONE)
+        except BaseException as ex:
+            self._fail(ex)
+
+    def _work(self, stage: Stage, index: int, remaining: list[int]):
+        in_queue, out_queue = self.queues[index], self.queues[index + 1]
+        try:
+            with stage.resource() as resource:
+                while True:
+                    start = time.perf_counter()
+                    item = self._get(in_queue)
+                    stage.add_stats(starved=time.perf_counter() - start)
+                    if item is _DONE:
+                        # let other workers of the stage know too
+                        self._put(in_queue, _DONE)
+                        break
+
+                    start = time.perf_counter()
+                    outputs = list(stage.func(resource, item))
+                    stage.add_stats(items=1, busy=time.perf_counter() - start)
+                    for output in outputs:
+                        stage.add_stats(blocked=self._put(out_queue, output))
+
+            with stage.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._put(out_queue, _DONE)
+        except BaseException as ex:
+            self._fail(ex)
+
+    def _fail(self, ex: BaseException):
+        if not self.aborted.is_set():
+            logger.exception(ex)
+            self.error = ex
+        self.aborted.set()
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self.aborted.is_set():
+                return _DONE
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _put(self, q: queue.Queue, item) -> float:
+        """Puts item in the queue; returns seconds spent waiting"""
+        start = time.perf_counter()
+        while not self.aborted.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+
+        return time.perf_counter() - start
+
+
+class IndexPipeline:
+    """Reads, converts and sends index entities in a pipeline
+
+    Stages:
+
+        - read: yields (key, chunk of nodes) tuples from `source`
+        - convert: turns chunk of nodes into index entities with
+          `convert(db_session, nodes)`; each worker has its own session
+        - batch: encodes entities and groups them in batches, leaving
+          out unchanged entities (unless `force` is set)
+        - write: sends batches to the index
+
+    `on_chunk_done` is called (in calling thread) with the key of each
+    chunk once all entities of the chunk, and of all the chunks before
+    it, are in the index.
+    """
+    def __init__(
+        self,
+        bulk_index: BulkIndex,
+        convert: Callable[[Any, list], list[IndexEntity]],
+        session_factory: Callable[[], AbstractContextManager],
+        converters: int = 1,
+        writers: int = 1,
+        queue_size: int = 4
+    ):
+        self.bulk_index = bulk_index
+        self.convert = convert
+        self.session_factory = session_factory
+        self.converters = converters
+        self.writers = writers
+        self.queue_size = queue_size
+        self.stats: list[StageStats] = []
+
+    def add(
+        self,
+        source: Iterable[tuple[Hashable, list]],
+        force: bool = False,
+        on_chunk_done: Callable[[Hashable], None] | None = None
+    ) -> int:
+        """Adds index entities of the nodes from `source` to the index
+
+        Batches are committed once, after all of them are sent.
+
+        Returns number of entities sent to the index.
+        """
+        def numbered():
+            for seq, (key, nodes) in enumerate(source):
+                yield seq, key, nodes
+
+        def convert(db_session, item):
+            seq, key, nodes = item
+            yield seq, key, self.convert(db_session, nodes)
+
+        def batch(_, item):
+            seq, key, entities = item
+            batches = list(self.bulk_index.batches(entities, force=force))
+            if not batches:
+                # chunk still needs to be reported as done
+                yield seq, key, None, 0
+            for docs in batches:
+                yield seq, key, docs, len(batches)
+
+        def write(_, item):
+            seq, key, docs, total = item
+            if docs:
+                self.bulk_index.send(docs, commit=False)
+                self.bulk_index.remember(docs)
+            yield seq, key, len(docs or []), total
+
+        pipeline = Pipeline(
+            numbered(),
+            [
+                Stage(
+                    'convert',
+                    convert,
+                    workers=self.converters,
+                    resource=self.session_factory
+                ),
+                Stage('batch', batch),
+                Stage('write', write, workers=self.writers),
+            ],
+            queue_size=self.queue_size
+        )
+        count = 0
+        next_seq = 0
+        chunks = {}  # seq -> [key, written batches, total batches]
+        outputs = pipeline.run()
+        try:
+            for seq, key, size, total in outputs:
+                count += size
+                chunk = chunks.setdefault(seq, [key, 0, total])
+                chunk[1] += 1
+                # report done chunks in order
+                while next_seq in chunks and (
+                    chunks[next_seq][1] >= max(chunks[next_seq][2], 1)
+                ):
+                    done_key = chunks.pop(next_seq)[0]
+                    next_seq += 1
+                    if on_chunk_done:
+                        on_chunk_done(done_key)
+        finally:
+            # stops the pipeline if loop above failed
+            outputs.close()
+            self.stats = pipeline.stats
+            # batches are sent without commit; what was written becomes
+            # visible even if the pipeline failed
+            if count and not self.bulk_index.defer_commit:
+                self.bulk_index.commit()
+
+        for stats in self.stats:
+            logger.debug(
+                f'Stage {stats.name} ({stats.workers} workers): '
+                f'{stats.items} items, busy {stats.busy:.2f}s, '
+                f'starved {stats.starved:.2f}s, blocked {stats.blocked:.2f}s'
+            )
+
+        return count
@@ -0,0 +1,125 @@
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+WATERMARK = 'watermark.json'
+RUN = 'run.json'
+
+
+class IndexState:
+    """Persisted state of `i3 index` runs
+
+    State is kept as a couple of small JSON files in `state_dir`:
+
+        - watermark.json: start time of the last successful run; nodes
+          updated after it still need to be (re)indexed
+        - run.json: start time (and `since` option) of the current run
+        - checkpoint-<after>-<until>.json: ID of the last node indexed
+          in given node ID range of the current run
+
+    Each node ID range is indexed by exactly one process, thus
+    processes never write the same file.
+    """
+    def __init__(self, state_dir: Path):
+        self.state_dir = Path(state_dir)
+
+    def get_watermark(self) -> datetime | None:
+        data = self._read(WATERMARK)
+        if data is None:
+            return None
+
+        return datetime.fromisoformat(data['watermark'])
+
+    def set_watermark(self, value: datetime):
+        self._write(WATERMARK, {'watermark': value.isoformat()})
+
+    def get_run(self) -> tuple[datetime, datetime | None] | None:
+        """Returns (started_at, since) of the unfinished run"""
+        data = self._read(RUN)
+        if data is None:
+            return None
+
+        since = data['since']
+        return (
+            datetime.fromisoformat(data['started_at']),
+            datetime.fromisoformat(since) if since else None
+        )
+
+    def start_run(self, started_at: datetime, since: datetime | None):
+        self.clear_run()
+        self._write(
+            RUN,
+            {
+                'started_at': started_at.isoformat(),
+                'since': since.isoformat() if since else None
+            }
+        )
+
+    def finish_run(self):
+        """Marks current run as successfully finished
+
+        Watermark is moved to the start time of the run, unless the run
+        skipped nodes which were updated after current watermark (i.e.
+        run was started with `since` later than the watermark).
+        """
+        run = self.get_run()
+        if run is not None:
+            started_at, since = run
+            watermark = self.get_watermark()
+            if since is None or (watermark is not None and since <= watermark):
+                self.set_watermark(started_at)
+        self.clear_run()
+
+    def clear_run(self):
+        for path in self.state_dir.glob('checkpoint-*.json'):
+            path.unlink()
+        (self.state_dir / RUN).unlink(missing_ok=True)
+
+    def get_checkpoint(
+        self,
+        after_id: uuid.UUID | None,
+        until_id: uuid.UUID | None
+    ) -> uuid.UUID | None:
+        """Returns ID of the last node indexed in given range"""
+        data = self._read(self._checkpoint_name(after_id, until_id))
+        if data is None:
+            return None
+
+        return uuid.UUID(data['last_id'])
+
+    def save_checkpoint(
+        self,
+        after_id: uuid.UUID | None,
+        until_id: uuid.UUID | None,
+        last_id: uuid.UUID
+    ):
+        self._write(
+            self._checkpoint_name(after_id, until_id),
+            {'last_id': str(last_id)}
+        )
+
+    def _checkpoint_name(
+        self,
+        after_id: uuid.UUID | None,
+        until_id: uuid.UUID | None
+    ) -> str:
+        return f'checkpoint-{after_id or "start"}-{until_id or "end"}.json'
+
+    def _read(self, name: str) -> dict | None:
+        path = self.state_dir / name
+        if not path.exists():
+            return None
+
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, name: str, data: dict):
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self.state_dir / name
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        # atomic; interrupted run never leaves half written file behind
+        os.replace(tmp_path, path)
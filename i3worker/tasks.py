@@ -1,26 +1,112 @@
 import uuid
 import logging
-from celery import shared_task
-from sqlalchemy.orm import Session
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable
+import redis
+import requests
+from celery import chord, group, shared_task
 from sqlalchemy import exc
 
-from i3worker import constants, schema
+from i3worker import constants, schema, utils
 from i3worker.db.engine import Session
 from i3worker.db import api
 from i3worker.config import get_settings
+from i3worker.bulk import BulkIndex, index_field_name
+from i3worker.pipeline import IndexPipeline
+from i3worker.coalesce import IndexBuffer, NODES, PAGES, VERSIONS
 from i3worker.index import IndexEntity, PAGE, FOLDER
 from salinic import IndexRW, create_engine
 
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
+# errors after which flush of the index buffer is retried
+FLUSH_RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    exc.OperationalError
+)
 
 
+@lru_cache()
 def get_index():
     engine = create_engine(settings.papermerge__search__url)
     return IndexRW(engine, schema=IndexEntity)
 
 
+@lru_cache()
+def get_bulk_index() -> BulkIndex:
+    """Returns index client of the current process
+
+    Client is created once per process and reused by all tasks, so that
+    HTTP connections to the search engine are kept alive between tasks.
+    """
+    return BulkIndex(get_index())
+
+
+def get_index_pipeline(bulk_index: BulkIndex | None = None) -> IndexPipeline:
+    """Returns pipeline which indexes chunks of nodes"""
+    return IndexPipeline(
+        bulk_index or get_bulk_index(),
+        convert=from_nodes,
+        session_factory=Session,
+        converters=settings.papermerge__pipeline__converters,
+        writers=settings.papermerge__search__concurrency,
+        queue_size=settings.papermerge__pipeline__queue_size
+    )
+
+
+def reset_index_after_fork():
+    """Creates new index client in the child process
+
+    HTTP connections must not be shared with the parent process.
+    """
+    get_index.cache_clear()
+    get_bulk_index.cache_clear()
+    get_bulk_index()
+
+
+@lru_cache()
+def get_buffer() -> IndexBuffer | None:
+    """Returns buffer for coalescing indexing events
+
+    Returns None if coalescing is disabled.
+    """
+    window = settings.papermerge__coalesce__window
+    if window <= 0 or settings.papermerge__redis__url is None:
+        return None
+
+    client = redis.Redis.from_url(settings.papermerge__redis__url)
+    return IndexBuffer(
+        client,
+        window=window,
+        max_batch=settings.papermerge__coalesce__max_batch
+    )
+
+
+def coalesce(kind: str, values: list[str]) -> bool:
+    """Pushes values to the buffer if coalescing is enabled
+
+    Returns True if values were buffered i.e. they will be processed
+    later by `flush_index_buffer` task. Raises ValueError if any of the
+    values is not a valid ID.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        return False
+
+    # invalid value would fail every flush it is part of
+    for value in values:
+        for id_ in value.split(':') if kind == VERSIONS else [value]:
+            uuid.UUID(id_)
+
+    if buffer.push(kind, values):
+        flush_index_buffer.apply_async(countdown=buffer.window)
+
+    return True
+
+
 @shared_task(name=constants.INDEX_ADD_NODE)
 def index_add_node(node_id: str):
     """Add node to the search index
@@ -31,9 +117,12 @@ def index_add_node(node_id: str):
     in index will be updated otherwise its record will be inserted.
     """
     logger.debug('Task started')
+    if coalesce(NODES, [node_id]):
+        return
+
     with Session() as db_session:
         node = api.get_node(db_session, uuid.UUID(node_id))
-        index = get_index()
+        index = get_bulk_index()
         logger.debug(f'Node={node}')
 
         if node.ctype == schema.NodeType.document:
@@ -42,26 +131,98 @@ def index_add_node(node_id: str):
             items = [from_folder(db_session, node)]
 
     logger.debug(f"Adding to index {items}")
-    for item in items:
-        index.add(item)
+    index.add(items)
 
 
 @shared_task(name=constants.INDEX_ADD_DOCS)
 def index_add_docs(doc_ids: list[str]):
-    """Add list of documents to index"""
-    logger.debug(f"Add docs with {doc_ids} BEGIN")
-    index = get_index()
+    """Add list of documents to index
+
+    Lists longer than `papermerge__celery__chunk_size` are split in chunks
+    indexed by `index_add_docs_chunk` tasks, i.e. by all available
+    workers at once, each chunk retried on its own.
+    """
+    chunk_size = settings.papermerge__celery__chunk_size
+    if chunk_size and len(doc_ids) > chunk_size:
+        _fan_out(doc_ids, chunk_size)
+        return
+
+    count = _add_docs(doc_ids)
+    logger.debug(f"Add docs: {count} items added to index")
+
+
+@shared_task(
+    name=constants.INDEX_ADD_DOCS_CHUNK,
+    priority=constants.BULK_PRIORITY,
+    ignore_result=False,
+    autoretry_for=(requests.RequestException, exc.OperationalError),
+    retry_backoff=True,
+    max_retries=5
+)
+def index_add_docs_chunk(doc_ids: list[str], number: int, total: int) -> int:
+    """Adds one chunk of the documents of a split `index_add_docs` call
+
+    Returns number of items added to the index.
+    """
+    count = _add_docs(doc_ids)
+    logger.info(
+        f"Add docs: chunk {number}/{total} done, "
+        f"{count} items added to index"
+    )
+
+    return count
+
+
+@shared_task(name=constants.INDEX_ADD_DOCS_DONE, ignore_result=False)
+def index_add_docs_done(counts: list[int], doc_count: int) -> dict:
+    """Called once all chunks of split `index_add_docs` call are done"""
+    result = {
+        'documents': doc_count,
+        'chunks': len(counts),
+        'items': sum(counts)
+    }
+    logger.info(f"Add docs done: {result}")
+
+    return result
+
+
+def _fan_out(doc_ids: list[str], chunk_size: int):
+    chunks = list(utils.chunked(doc_ids, chunk_size))
+    header = group(
+        index_add_docs_chunk.s(chunk, number, len(chunks))
+        for number, chunk in enumerate(chunks, start=1)
+    )
+    logger.info(
+        f"Add docs: {len(doc_ids)} documents split in {len(chunks)} chunks"
+    )
+    if index_add_docs_chunk.app.conf.result_backend:
+        chord(header)(index_add_docs_done.s(len(doc_ids)))
+    else:
+        # chord needs result backend to know when all chunks are done
+        header.apply_async()
+
+
+def _add_docs(doc_ids: list[str]) -> int:
+    pipeline = get_index_pipeline()
     with Session() as db_session:
-        docs = api.get_docs(
-            db_session,
-            [uuid.UUID(doc_id) for doc_id in doc_ids]
-        )
+        def chunks():
+            for chunk in utils.chunked(doc_ids, api.CHUNK_SIZE):
+                docs = api.get_docs(
+                    db_session,
+                    [uuid.UUID(doc_id) for doc_id in chunk]
+                )
+                yield chunk[-1], docs
+
+        return pipeline.add(chunks())
+
 
-        for doc in docs:
-            items = from_document(db_session, doc)
-            for item in items:
-                logger.debug(f"Adding {item} to index")
-                index.add(item)
+@shared_task(
+    name=constants.INDEX_ADD_DOCS_BULK,
+    priority=constants.BULK_PRIORITY
+)
+def index_add_docs_bulk(doc_ids: list[str]):
+    """Same as `index_add_docs`, for mass imports (runs from bulk queue)"""
+    index_add_docs(doc_ids)
 
 
 @shared_task(name=constants.INDEX_REMOVE_NODE)
@@ -72,30 +233,142 @@ def remove_folder_or_page_from_index(item_ids: list[str]):
     logger.debug(
         f"Remove pages or folder from index len(item_ids)= {len(item_ids)}"
     )
-    index = get_index()
-    for item_id in item_ids:
-        try:
-            logger.debug(f'index remove {item_id}')
-            index.remove(id=item_id)
-        except Exception as exc:
-            logger.error(exc)
-            raise
+    try:
+        get_bulk_index().remove(item_ids)
+    except Exception as exc:
+        logger.error(exc)
+        raise
 
     logger.debug('End of remove_folder_or_page_from_index')
 
 
+@shared_task(name=constants.INDEX_REMOVE_DOCS)
+def remove_docs_from_index(doc_ids: list[str]):
+    """Removes all pages of given documents from search index
+
+    Pages are looked up in the index by their `document_id`, thus
+    neither page IDs nor database access are needed.
+    """
+    logger.debug(f'Removing pages of documents {doc_ids} from index')
+    get_bulk_index().remove_documents(doc_ids)
+
+
+@shared_task(name=constants.INDEX_RENAME_NODE)
+def rename_node(node_id: str):
+    """Updates title of the node in the index
+
+    Meant for when the node was renamed: only the title field of
+    the folder entity, or of all the page entities of the document, is
+    sent, as atomic update, instead of re-adding the entities with all
+    their text. Pages are looked up in the index, not in the database.
+    """
+    logger.debug(f'Updating title of node {node_id}')
+    with Session() as db_session:
+        node = api.get_node(db_session, uuid.UUID(node_id))
+
+    lang = IndexEntity.model_fields['lang'].default
+    fields = {index_field_name('title', lang): node.title}
+    index = get_bulk_index()
+    if node.ctype == schema.NodeType.document:
+        count = index.set_document_fields([node_id], fields)
+    else:
+        count = index.set_fields([(node_id, fields)])
+
+    logger.debug(f'Updated title of {count} entities')
+
+
+@shared_task(name=constants.INDEX_UPDATE_TAGS)
+def update_tags(node_ids: list[str]):
+    """Updates tags of given nodes in the index
+
+    Meant for when tags are attached to or detached from nodes: only
+    the `tags` field of the nodes' entities (the folder or the pages
+    of document's last version) is sent, as atomic update, instead of
+    re-adding the entities with all their text.
+    """
+    logger.debug(f'Updating tags of nodes {node_ids}')
+    with Session() as db_session:
+        count = _update_tags(
+            db_session,
+            [uuid.UUID(node_id) for node_id in node_ids]
+        )
+
+    logger.debug(f'Updated tags of {count} entities')
+
+
+@shared_task(
+    name=constants.INDEX_RENAME_TAG,
+    priority=constants.BULK_PRIORITY
+)
+def rename_tag(tag_id: str):
+    """Updates tags of all nodes tagged with given tag
+
+    Meant for when the tag was renamed; see `update_tags`.
+    """
+    logger.debug(f'Updating tags of nodes tagged with {tag_id}')
+    with Session() as db_session:
+        node_ids = api.get_tagged_node_ids(db_session, uuid.UUID(tag_id))
+        count = _update_tags(db_session, node_ids)
+
+    logger.debug(f'Updated tags of {count} entities')
+
+
+def _update_tags(db_session: Session, node_ids: list[uuid.UUID]) -> int:
+    def updates():
+        for chunk in utils.chunked(node_ids, api.CHUNK_SIZE):
+            entity_ids = api.get_entity_ids(db_session, chunk)
+            tags = api.get_tag_names(db_session, chunk)
+            for node_id, ids in entity_ids.items():
+                fields = {'tags': tags.get(node_id, [])}
+                for entity_id in ids:
+                    yield str(entity_id), fields
+
+    return get_bulk_index().set_fields(updates())
+
+
 @shared_task(name=constants.INDEX_ADD_PAGES)
 def add_pages_to_index(page_ids: list[str]):
+    if coalesce(PAGES, page_ids):
+        return
+
+    with Session() as db_session:
+        _add_pages_to_index(db_session, page_ids)
+
+
+@shared_task(
+    name=constants.INDEX_ADD_PAGES_BULK,
+    priority=constants.BULK_PRIORITY
+)
+def add_pages_to_index_bulk(page_ids: list[str]):
+    """Same as `add_pages_to_index`, for mass indexing (runs from bulk
+    queue); pages are added right away, without coalescing"""
     with Session() as db_session:
-        index_entities = [
-            from_page(db_session, uuid.UUID(page_id)) for page_id in page_ids
-        ]
-        logger.debug(
-            f"Add pages to index: {index_entities}"
+        _add_pages_to_index(db_session, page_ids)
+
+
+def _add_pages_to_index(db_session: Session, page_ids: list[str]):
+    index_entities = _page_entities(db_session, page_ids)
+    logger.debug(
+        f"Add pages to index: {index_entities}"
+    )
+    index = get_bulk_index()
+    index.add(index_entities)
+
+
+def _page_entities(
+    db_session: Session,
+    page_ids: Iterable[str]
+) -> list[IndexEntity]:
+    index_entities = []
+    for chunk in utils.chunked(page_ids, api.CHUNK_SIZE):
+        index_entities.extend(
+            from_pages(
+                db_session,
+                [uuid.UUID(page_id) for page_id in chunk]
+            )
         )
-        index = get_index()
-        for model in index_entities:
-            index.add(model)
+
+    return index_entities
 
 
 @shared_task(name=constants.INDEX_UPDATE)
@@ -103,69 +376,178 @@ def update_index(add_ver_id: str, remove_ver_id: str):
     """Updates index
 
     Removes pages of `remove_ver_id` document version and adds
-    pages of `add_ver_id` from/to index in one "transaction".
+    pages of `add_ver_id` from/to index in one "transaction" i.e.
+    with one update request committed once.
     """
     logger.debug(
         f"Index Update: add={add_ver_id}, remove={remove_ver_id}"
     )
-    add_ver = None
-    remove_ver = None
+    if coalesce(VERSIONS, [f"{add_ver_id}:{remove_ver_id}"]):
+        return
+
     with Session() as db_session:
-        try:
-            add_ver = api.get_doc_ver(db_session, uuid.UUID(add_ver_id))
-        except exc.NoResultFound:
-            logger.debug(
-                f"Index add doc version {add_ver_id} not found."
+        page_ids = _version_page_ids(db_session, [add_ver_id, remove_ver_id])
+        add_page_ids = page_ids[add_ver_id]
+        remove_page_ids = page_ids[remove_ver_id]
+        index_entities = _page_entities(db_session, add_page_ids)
+
+    if len(index_entities) == 0 and len(remove_page_ids) == 0:
+        logger.debug("Empty page ids. Nothing to update")
+        return
+
+    get_bulk_index().update(index_entities, remove_page_ids)
+
+
+@shared_task(
+    name=constants.INDEX_FLUSH,
+    autoretry_for=FLUSH_RETRY_ERRORS,
+    retry_backoff=True,
+    max_retries=5
+)
+def flush_index_buffer():
+    """Processes IDs collected in the buffer
+
+    All buffered nodes, pages and document versions are loaded from the
+    database and sent to the index together, with one bulk update which
+    also removes pages of replaced document versions; each entity is sent
+    once no matter how many times it was pushed to the buffer.
+
+    If flush fails with a temporary error (connection to search engine
+    or database), IDs are pushed back to the buffer, to be processed when
+    the task is retried (or by the next flush). On any other error IDs
+    are logged and dropped, so that e.g. a document rejected by the search
+    engine does not block the rest of the buffer.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        return
+
+    items = buffer.pop()
+    logger.debug(
+        f"Flush index buffer: {len(items[NODES])} nodes, "
+        f"{len(items[PAGES])} pages, {len(items[VERSIONS])} versions"
+    )
+    try:
+        _flush(items)
+    except FLUSH_RETRY_ERRORS:
+        buffer.restore(items)
+        raise
+    except Exception:
+        logger.exception(f"Flush index buffer failed, dropping {items}")
+        if buffer.pending():
+            flush_index_buffer.delay()
+        raise
+
+    if buffer.pending():
+        # more than `max_batch` values were buffered
+        flush_index_buffer.delay()
+
+
+def _flush(items: dict[str, list[str]]):
+    entities = {}
+    page_ids = set(items[PAGES])
+    remove_page_ids = set()
+    with Session() as db_session:
+        if items[NODES]:
+            nodes = api.get_nodes(
+                db_session,
+                [uuid.UUID(node_id) for node_id in items[NODES]]
             )
-        try:
-            remove_ver = api.get_doc_ver(db_session, uuid.UUID(remove_ver_id))
-        except exc.NoResultFound:
-            logger.warning(f"Index remove doc version {remove_ver_id} not found")
-
-        if add_ver:  # doc ver is there, but does it have pages?
-            add_page_ids = [str(page.id) for page in add_ver.pages]
-            if len(add_page_ids) > 0:
-                # doc ver is there and it has pages
-                add_pages_to_index(add_page_ids)
-            else:
-                logger.debug("Empty page ids. Nothing to add to index")
-
-        if remove_ver:  # doc ver is there, but does it have pages?
-            remove_page_ids = [str(page.id) for page in remove_ver.pages]
-            if len(remove_page_ids) > 0:
-                # doc ver is there and it has pages
-                remove_folder_or_page_from_index(remove_page_ids)
-            else:
-                logger.debug("Empty page ids. Nothing to remove from index")
+            for entity in from_nodes(db_session, nodes):
+                entities[entity.id] = entity
+
+        pairs = [pair.split(':') for pair in items[VERSIONS]]
+        version_page_ids = _version_page_ids(
+            db_session,
+            [ver_id for pair in pairs for ver_id in pair]
+        )
+        for add_ver_id, remove_ver_id in pairs:
+            page_ids.update(version_page_ids[add_ver_id])
+            remove_page_ids.update(version_page_ids[remove_ver_id])
+
+        # version replaced within the window (e.g. B by C after A by B)
+        # is replaced in the index too: its pages are removed, not added
+        page_ids -= remove_page_ids
+        swap_page_ids = {
+            page_id
+            for add_ver_id, _ in pairs
+            for page_id in version_page_ids[add_ver_id]
+        } & page_ids
+        page_ids -= entities.keys()
+        for entity in _page_entities(db_session, page_ids):
+            entities[entity.id] = entity
+
+    remove_page_ids -= entities.keys()
+    # pages of new versions replace pages of old versions with one
+    # request (see `BulkIndex.update`), everything else is sent in batches
+    index = get_bulk_index()
+    index.add(
+        entity for entity in entities.values()
+        if entity.id not in swap_page_ids
+    )
+    index.update(
+        [e for e in entities.values() if e.id in swap_page_ids],
+        list(remove_page_ids)
+    )
+
+
+def _version_page_ids(
+    db_session: Session,
+    doc_ver_ids: list[str]
+) -> dict[str, list[str]]:
+    """Returns page IDs of given document versions, keyed by version ID
+
+    Only IDs are read from the database (no page text), with one query.
+    Versions not found in the database get empty list.
+    """
+    found = api.get_version_page_ids(
+        db_session,
+        list({uuid.UUID(doc_ver_id) for doc_ver_id in doc_ver_ids})
+    )
+    result = {}
+    for doc_ver_id in doc_ver_ids:
+        page_ids = found.get(uuid.UUID(doc_ver_id), [])
+        if len(page_ids) == 0:
+            logger.debug(f"Doc version {doc_ver_id} not found or has no pages")
+        result[doc_ver_id] = [str(page_id) for page_id in page_ids]
+
+    return result
 
 
 def from_page(db_session: Session, page_id: uuid.UUID) -> IndexEntity:
     """Given page_id returns index entity"""
-    with Session() as db_session:
-        page = api.get_page(db_session, page_id)
-        last_doc_ver = api.get_doc_ver(db_session, page.document_version_id)
-        doc = api.get_doc(db_session, last_doc_ver.document_id)
-
-        if len(page.text) == 0 and last_doc_ver.number > 1:
-            logger.warning(
-                f"NO OCR TEXT FOUND! version={last_doc_ver.number} "
-                f" title={doc.title}"
-                f" page.number={page.number}"
-                f" doc.ID={doc.id}"
-            )
+    index_entities = from_pages(db_session, [page_id])
 
-    index_entity = IndexEntity(
-        id=str(page.id),
-        title=doc.title,
-        user_id=str(doc.user_id),
-        document_id=str(doc.id),
-        page_number=page.number,
-        text=page.text,
-        entity_type=PAGE,
-        tags=[tag.name for tag in doc.tags],
+    if len(index_entities) == 0:
+        raise exc.NoResultFound(f"Page {page_id} not found")
+
+    return index_entities[0]
+
+
+def from_pages(
+    db_session: Session,
+    page_ids: list[uuid.UUID]
+) -> list[IndexEntity]:
+    """Given list of page IDs returns their index entities
+
+    Pages with data of their documents, and tags of the documents, are
+    loaded with two queries.
+    """
+    rows = api.get_page_rows(db_session, page_ids)
+    tags = api.get_tag_names(
+        db_session,
+        list({row.document_id for row in rows})
     )
 
-    return index_entity
+    return [
+        _page_entity(
+            row,
+            title=row.title,
+            user_id=row.user_id,
+            tags=tags.get(row.document_id, [])
+        )
+        for row in rows
+    ]
 
 
 def from_folder(db_session: Session, node: schema.Node) -> IndexEntity:
@@ -174,36 +556,99 @@ def from_folder(db_session: Session, node: schema.Node) -> IndexEntity:
         title=node.title,
         user_id=str(node.user_id),
         entity_type=FOLDER,
-        tags=[t.name for t in node.tags]
+        tags=sorted(t.name for t in node.tags)
     )
 
     return index_entity
 
 
+def from_nodes(
+    db_session: Session,
+    nodes: list[schema.Document | schema.Folder]
+) -> list[IndexEntity]:
+    """Returns index entities of given documents and folders"""
+    docs = [node for node in nodes if isinstance(node, schema.Document)]
+    result = from_documents(db_session, docs)
+    for node in nodes:
+        if not isinstance(node, schema.Document):
+            result.append(from_folder(db_session, node))
+
+    return result
+
+
 def from_document(db_session: Session, node: schema.Document) -> list[IndexEntity]:
-    result = []
+    return from_documents(db_session, [node])
 
-    with Session() as db_session:
-        last_ver: schema.DocumentVersion = api.get_last_version(db_session, node.id)
-        for page in api.get_pages(db_session, last_ver.id):
-            if (page.text is None) or (len(page.text) == 0 and last_ver.number > 1):
-                logger.warning(
-                    f"NO OCR TEXT FOUND! version={last_ver.number} "
-                    f" title={node.title}"
-                    f" page.number={page.number}"
-                    f" doc.ID={node.id}"
-                )
 
-            index_entity = IndexEntity(
-                id=str(page.id),
-                title=node.title,
-                user_id=str(node.user_id),
-                document_id=str(node.id),
-                page_number=page.number,
-                text=page.text,
-                entity_type=PAGE,
-                tags=[t.name for t in node.tags],
+def from_documents(
+    db_session: Session,
+    nodes: list[schema.Document]
+) -> list[IndexEntity]:
+    """Returns index entities of the last version pages of given documents
+
+    Pages of the last versions of all documents are loaded with
+    one query.
+    """
+    result = []
+    pages = defaultdict(list)
+    for row in api.get_last_version_page_rows(
+        db_session,
+        [node.id for node in nodes]
+    ):
+        pages[row.document_id].append(row)
+
+    for node in nodes:
+        if node.id not in pages:
+            logger.warning(f"Document {node.id} has no versions")
+            continue
+
+        tags = sorted(t.name for t in node.tags)
+        for row in pages[node.id]:
+            result.append(
+                _page_entity(
+                    row,
+                    title=node.title,
+                    user_id=node.user_id,
+                    tags=tags
+                )
             )
-            result.append(index_entity)
 
     return result
+
+
+def _page_entity(
+    row,
+    title: str,
+    user_id: uuid.UUID,
+    tags: list[str]
+) -> IndexEntity:
+    """Returns index entity of the page
+
+    `row` is a database row with page's `id`, `number`, `text`,
+    `document_id` and `version_number`.
+
+    Values come straight from the database with known types, thus entity
+    is built without pydantic validation (`model_construct`); validation
+    was the largest CPU cost of indexing.
+
+    `tags` must be sorted (as by `api.get_tag_names`), so that the same
+    page is always encoded the same way and its fingerprint matches.
+    """
+    if (row.text is None) or (len(row.text) == 0 and row.version_number > 1):
+        logger.warning(
+            f"NO OCR TEXT FOUND! version={row.version_number} "
+            f" title={title}"
+            f" page.number={row.number}"
+            f" doc.ID={row.document_id}"
+        )
+
+    return IndexEntity.model_construct(
+        id=str(row.id),
+        title=title,
+        user_id=str(user_id),
+        document_id=str(row.document_id),
+        page_number=row.number,
+        text=row.text,
+        entity_type=PAGE,
+        tags=tags,
+    )
@@ -1,6 +1,11 @@
+import uuid
 import yaml
+from itertools import islice
 from pathlib import Path
 from logging.config import dictConfig
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
 
 
 def setup_logging(config: Path):
@@ -11,3 +16,24 @@ def setup_logging(config: Path):
         config = yaml.load(stream, Loader=yaml.FullLoader)
 
     dictConfig(config)
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Splits iterable into lists of at most `size` items"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def uuid_ranges(count: int) -> list[tuple[uuid.UUID | None, uuid.UUID | None]]:
+    """Splits UUID space in `count` ranges of equal size
+
+    Each range is a tuple (after, until) and includes UUIDs
+    greater than `after` and less or equal to `until`. `after` of
+    first range and `until` of last range are None i.e. unbounded.
+    """
+    bounds = [None]
+    bounds += [uuid.UUID(int=i * 2**128 // count) for i in range(1, count)]
+    bounds += [None]
+
+    return list(zip(bounds[:-1], bounds[1:]))
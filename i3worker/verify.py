@@ -0,0 +1,115 @@
+import heapq
+from typing import Callable, Iterator, NamedTuple
+
+from i3worker import constants
+from i3worker.index import FOLDER, PAGE
+
+MISSING = 'missing'  # in the database, but not in the index
+ORPHANED = 'orphaned'  # in the index, but not in the database
+
+
+class Difference(NamedTuple):
+    status: str  # MISSING | ORPHANED
+    id: str
+    entity_type: str | None  # FOLDER | PAGE; None for orphaned entities
+
+
+def db_entries(
+    folder_ids: Iterator,
+    page_ids: Iterator
+) -> Iterator[tuple[str, str]]:
+    """Merges sorted folder and page IDs in one sorted stream
+
+    Yields (id, entity type) tuples.
+    """
+    folders = ((str(folder_id), FOLDER) for folder_id in folder_ids)
+    pages = ((str(page_id), PAGE) for page_id in page_ids)
+
+    return heapq.merge(folders, pages)
+
+
+def diff(
+    db_entries: Iterator[tuple[str, str]],
+    index_ids: Iterator[str]
+) -> Iterator[Difference]:
+    """Yields differences between two sorted ID streams
+
+    Streams are compared with a merge, thus memory usage does not depend
+    on the number of IDs.
+    """
+    db_entry = next(db_entries, None)
+    index_id = next(index_ids, None)
+    last_db_id = last_index_id = None
+    while db_entry is not None or index_id is not None:
+        if db_entry is not None:
+            _check_order(last_db_id, db_entry[0])
+            last_db_id = db_entry[0]
+        if index_id is not None:
+            _check_order(last_index_id, index_id)
+            last_index_id = index_id
+
+        if index_id is None or (
+            db_entry is not None and db_entry[0] < index_id
+        ):
+            yield Difference(MISSING, *db_entry)
+            db_entry = next(db_entries, None)
+        elif db_entry is None or index_id < db_entry[0]:
+            yield Difference(ORPHANED, index_id, None)
+            index_id = next(index_ids, None)
+        else:
+            db_entry = next(db_entries, None)
+            index_id = next(index_ids, None)
+
+
+def _check_order(last_id: str | None, current_id: str):
+    if last_id is not None and current_id < last_id:
+        raise ValueError(
+            f"IDs are not sorted: {current_id} came after {last_id}"
+        )
+
+
+class Repair:
+    """Enqueues tasks which fix found differences
+
+    Missing pages are added and orphaned entities are removed
+    in chunks of `chunk_size` IDs per task; missing folders are added
+    one per task.
+    """
+    def __init__(self, send_task: Callable, chunk_size: int = 500):
+        self.send_task = send_task
+        self.chunk_size = chunk_size
+        self.page_ids = []
+        self.orphaned_ids = []
+
+    def push(self, difference: Difference):
+        if difference.status == ORPHANED:
+            self.orphaned_ids.append(difference.id)
+        elif difference.entity_type == FOLDER:
+            self.send_task(constants.INDEX_ADD_NODE, args=[difference.id])
+        else:
+            self.page_ids.append(difference.id)
+
+        if len(self.page_ids) >= self.chunk_size:
+            self._flush_pages()
+        if len(self.orphaned_ids) >= self.chunk_size:
+            self._flush_orphaned()
+
+    def flush(self):
+        self._flush_pages()
+        self._flush_orphaned()
+
+    def _flush_pages(self):
+        if self.page_ids:
+            self.send_task(
+                constants.INDEX_ADD_PAGES_BULK,
+                args=[self.page_ids]
+            )
+            self.page_ids = []
+
+    def _flush_orphaned(self):
+        if self.orphaned_ids:
+            self.send_task(
+                constants.INDEX_REMOVE_NODE,
+                args=[self.orphaned_ids]
+            )
+            self.orphaned_ids = []
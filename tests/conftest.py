@@ -1,27 +1,134 @@
+import json
+import os
 import uuid
 
 import pytest
-from i3worker.db.models import (
+
+os.environ.setdefault("PAPERMERGE__SEARCH__URL", "solr://localhost:8983/i3")
+os.environ.setdefault(
+    "PAPERMERGE__DATABASE__URL",
+    "sqlite:///test_db.sqlite3"
+)
+
+from i3worker.db.orm import (  # noqa: E402
     Folder,
     Document,
     DocumentVersion,
     Page,
     Tag,
-    ColoredTag,
+    NodeTagsAssociation,
     User
 )
-from i3worker import db
-from i3worker.db import Base, get_engine
+from i3worker.db.base import Base  # noqa: E402
+from i3worker.db.engine import Session, get_engine  # noqa: E402
+from salinic import IndexRW, create_engine  # noqa: E402
+
+from i3worker import tasks  # noqa: E402
+from i3worker.bulk import BulkIndex  # noqa: E402
+from i3worker.index import IndexEntity  # noqa: E402
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data=None):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeHTTP:
+    """Records requests instead of sending them to the search engine
+
+    Update requests (POST) are recorded in `requests` as (body, params),
+    others (GET) in `gets` as (url, params). GET responses return `data`;
+    if `error` is set, it is raised by every request.
+    """
+    def __init__(self):
+        self.data = {}
+        self.error = None
+        self.requests = []
+        self.gets = []
+
+    def post(self, url, data, params, **kwargs):
+        if self.error:
+            raise self.error
+        self.requests.append((data.decode('utf-8'), params))
+        return FakeResponse()
+
+    def get(self, url, params, **kwargs):
+        if self.error:
+            raise self.error
+        self.gets.append((url, params))
+        return FakeResponse(self.data)
+
+    def commands(self) -> list[tuple[str, object]]:
+        """Returns (name, value) of update commands of all requests
+        in order; command names may repeat within a request"""
+        result = []
+        for body, _ in self.requests:
+            commands = json.loads(body, object_pairs_hook=lambda p: p)
+            if body.startswith("["):
+                # JSON array of docs
+                commands = [("add", [("doc", doc)]) for doc in commands]
+            result.extend((key, _objects(value)) for key, value in commands)
+        return result
+
+    @property
+    def added(self) -> list[str]:
+        """IDs of added docs"""
+        return [
+            value["doc"]["id"]
+            for key, value in self.commands() if key == "add"
+        ]
+
+    @property
+    def deleted(self) -> list:
+        """IDs of deleted entities and delete queries"""
+        deleted = []
+        for key, value in self.commands():
+            if key == "delete":
+                deleted.extend(value if isinstance(value, list) else [value])
+        return deleted
+
+
+def _objects(value):
+    """Turns lists of (key, value) pairs back into dicts"""
+    if isinstance(value, list):
+        if value and all(isinstance(item, tuple) for item in value):
+            return {key: _objects(item) for key, item in value}
+        return [_objects(item) for item in value]
+    return value
+
+
+@pytest.fixture()
+def fake_http():
+    return FakeHTTP()
+
+
+@pytest.fixture()
+def index():
+    return IndexRW(create_engine("solr://localhost:8983/i3"), IndexEntity)
+
+
+@pytest.fixture()
+def bulk_index(monkeypatch, index, fake_http):
+    """BulkIndex used by the tasks, sending to `fake_http`"""
+    bulk_index = BulkIndex(index, http=fake_http)
+    monkeypatch.setattr(tasks, "get_bulk_index", lambda: bulk_index)
+    return bulk_index
 
 
 @pytest.fixture(scope="function")
 def session():
-    url = "sqlite:///test_db.sqlite3"
-    engine = get_engine(url)
+    engine = get_engine()
     Base.metadata.create_all(engine)
-    db_session = db.get_db(url=url)
     try:
-        with db_session() as se:
+        with Session() as se:
             yield se
     finally:
         Base.metadata.drop_all(engine)
@@ -59,13 +166,13 @@ def folder_factory(session, socrates):
         for index, name in enumerate(tags or []):
             tag_id = uuid.uuid4()
             db_tag = Tag(name=name, id=tag_id)
-            db_colored_tag = ColoredTag(
+            db_node_tag = NodeTagsAssociation(
                 id=index + 1,
-                object_id=folder_id,
+                node_id=folder_id,
                 tag_id=tag_id
             )
             session.add(db_tag)
-            session.add(db_colored_tag)
+            session.add(db_node_tag)
 
         session.commit()
 
@@ -0,0 +1,98 @@
+import uuid
+
+from sqlalchemy import select
+
+from i3worker.db import api
+from i3worker.db.orm import DocumentVersion, Page
+
+
+def test_iter_nodes_reads_all_nodes_in_chunks(session, folder_factory):
+    """`iter_nodes` should yield every node even when there are
+    more nodes than `chunk_size`"""
+    titles = {f"Folder {i}" for i in range(7)}
+    for title in titles:
+        folder_factory(title=title)
+
+    nodes = list(api.iter_nodes(session, chunk_size=3))
+
+    assert {node.title for node in nodes} == titles
+    assert [n.id for n in nodes] == sorted(n.id for n in nodes)
+
+
+def test_get_last_version_page_rows(session, doc_factory):
+    """`get_last_version_page_rows` should return pages of last version
+    of each given document, sorted by number"""
+    doc1 = doc_factory(title="doc1.pdf", page_count=2)
+    doc2 = doc_factory(title="doc2.pdf", page_count=3)
+
+    rows = api.get_last_version_page_rows(session, [doc1.id, doc2.id])
+
+    assert [r.number for r in rows if r.document_id == doc1.id] == [1, 2]
+    assert [r.number for r in rows if r.document_id == doc2.id] == [1, 2, 3]
+
+
+def test_iter_last_version_page_ids(session, doc_factory):
+    """`iter_last_version_page_ids` should yield sorted page IDs"""
+    doc_factory(title="doc1.pdf", page_count=2)
+    doc_factory(title="doc2.pdf", page_count=3)
+
+    page_ids = list(api.iter_last_version_page_ids(session))
+
+    assert len(page_ids) == 5
+    assert page_ids == sorted(page_ids)
+
+
+def test_get_version_page_ids(session, doc_factory):
+    """`get_version_page_ids` should return page IDs, sorted by page
+    number, of each given version; unknown versions are left out"""
+    doc1 = doc_factory(title="doc1.pdf", page_count=2)
+    doc2 = doc_factory(title="doc2.pdf", page_count=3)
+    ver1, ver2 = (
+        session.scalars(
+            select(DocumentVersion).where(DocumentVersion.document_id == doc.id)
+        ).one()
+        for doc in (doc1, doc2)
+    )
+
+    def page_ids_of(ver):
+        return list(
+            session.scalars(
+                select(Page.id).where(
+                    Page.document_version_id == ver.id
+                ).order_by(Page.number)
+            )
+        )
+
+    page_ids = api.get_version_page_ids(
+        session,
+        [ver1.id, ver2.id, uuid.uuid4()]
+    )
+
+    assert page_ids == {
+        ver1.id: page_ids_of(ver1),
+        ver2.id: page_ids_of(ver2),
+    }
+
+
+def test_get_tag_names(session, folder_factory):
+    """`get_tag_names` should return tag names of each given node"""
+    folder1 = folder_factory(title="Folder 1", tags=["one", "two"])
+    folder2 = folder_factory(title="Folder 2")
+
+    tag_names = api.get_tag_names(session, [folder1.id, folder2.id])
+
+    assert set(tag_names[folder1.id]) == {"one", "two"}
+    assert folder2.id not in tag_names
+
+
+def test_get_entity_ids(session, folder_factory, doc_factory):
+    """`get_entity_ids` should return folder ID for folder and last
+    version page IDs for document"""
+    folder = folder_factory(title="Folder")
+    doc = doc_factory(title="doc.pdf", page_count=2)
+    rows = api.get_last_version_page_rows(session, [doc.id])
+
+    entity_ids = api.get_entity_ids(session, [folder.id, doc.id])
+
+    assert entity_ids[folder.id] == [folder.id]
+    assert set(entity_ids[doc.id]) == {row.id for row in rows}
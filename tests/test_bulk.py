@@ -0,0 +1,204 @@
+import json
+
+from i3worker.bulk import (
+    BulkIndex, batched, encode, index_field_name, to_doc
+)
+from i3worker.fingerprint import FingerprintStore
+from i3worker.index import IndexEntity
+
+
+def test_to_doc_adds_lang_suffix():
+    entity = IndexEntity(
+        id="c0d05a9b-2ba0-4a14-9e9c-3e5a5b0e2f11",
+        title="receipt.pdf",
+        user_id="u1",
+        text="hello",
+        lang="de",
+    )
+
+    doc = to_doc(entity)
+
+    assert doc["title_txt_de"] == "receipt.pdf"
+    assert doc["text_txt_de"] == "hello"
+    assert "title" not in doc
+
+
+def test_batched_respects_max_count():
+    docs = [encode({"id": str(i)}) for i in range(7)]
+
+    batches = list(batched(docs, max_count=3, max_bytes=1024))
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert json.loads(batches[2][0].data) == {"id": "6"}
+
+
+def test_batched_respects_max_bytes():
+    docs = [
+        encode({"id": "1", "text": "a" * 50}),
+        encode({"id": "2", "text": "b" * 50}),
+        encode({"id": "3", "text": "c" * 500}),  # larger than max_bytes alone
+        encode({"id": "4", "text": "d"}),
+    ]
+
+    batches = list(batched(docs, max_count=100, max_bytes=100))
+
+    assert [len(batch) for batch in batches] == [1, 1, 1, 1]
+    assert sum(len(b) for b in batches) == 4
+
+
+def test_fingerprint_store(tmp_path):
+    store = FingerprintStore(tmp_path / "fingerprints.sqlite3")
+    store.save([("p1", "d1", "aaa"), ("p2", "d1", "bbb"), ("f1", None, "ccc")])
+
+    assert store.get(["p1", "f1", "xx"]) == {"p1": "aaa", "f1": "ccc"}
+
+    store.delete_documents(["d1"])
+
+    assert store.get(["p1", "p2", "f1"]) == {"f1": "ccc"}
+
+
+def test_use_fingerprints_false_ignores_store(tmp_path, index, fake_http):
+    store = FingerprintStore(tmp_path / "fingerprints.sqlite3")
+    bulk_index = BulkIndex(
+        index, http=fake_http, fingerprints=store, use_fingerprints=False
+    )
+    entity = IndexEntity(id="p1", title="doc.pdf", user_id="u1", text="x")
+
+    assert bulk_index.add([entity]) == 1
+    assert bulk_index.add([entity]) == 1
+    assert store.get(["p1"]) == {}
+
+
+def test_update_sends_one_request(index, fake_http):
+    """Version swap should be sent as one request even if it does
+    not fit in one batch"""
+    bulk_index = BulkIndex(index, batch_size=2, http=fake_http)
+    entities = [
+        IndexEntity(id=f"p{i}", title="doc.pdf", user_id="u1", text="x")
+        for i in range(3)
+    ]
+
+    count = bulk_index.update(entities, remove_ids=["old1", "old2"])
+
+    assert count == 3
+    assert [params["commit"] for _, params in fake_http.requests] == ["true"]
+    payload = fake_http.requests[0][0]
+    assert payload.count('"add":') == 3
+    assert '"delete":["old1", "old2"]' in payload
+
+
+def test_defer_commit(index, fake_http):
+    bulk_index = BulkIndex(
+        index, batch_size=2, http=fake_http, defer_commit=True
+    )
+    entities = [
+        IndexEntity(id=f"p{i}", title="doc.pdf", user_id="u1", text="x")
+        for i in range(3)
+    ]
+
+    bulk_index.add(entities)
+    bulk_index.update(entities, remove_ids=["old1"])
+    bulk_index.commit()
+
+    assert all(
+        params["commit"] == "false" for _, params in fake_http.requests
+    )
+    assert fake_http.requests[-1][0] == '{"commit": {}}'
+
+
+def test_set_fields_sends_atomic_updates(index, fake_http):
+    bulk_index = BulkIndex(index, batch_size=2, http=fake_http)
+
+    count = bulk_index.set_fields(
+        (f"p{i}", {"tags": ["one"]}) for i in range(3)
+    )
+
+    assert count == 3
+    assert [params["commit"] for _, params in fake_http.requests] == [
+        "false", "true"
+    ]
+    docs = json.loads(fake_http.requests[0][0])
+    assert docs[0] == {"id": "p0", "_version_": 1, "tags": {"set": ["one"]}}
+    assert all(
+        params["failOnVersionConflicts"] == "false"
+        for _, params in fake_http.requests
+    )
+
+
+def test_index_field_name():
+    assert index_field_name("title", "de") == "title_txt_de"
+    assert index_field_name("tags", "de") == "tags"
+
+
+def test_set_document_fields_looks_up_pages_in_index(index, fake_http):
+    fake_http.data = {
+        "response": {"docs": [{"id": "p1"}, {"id": "p2"}]},
+        "nextCursorMark": "next"
+    }
+    bulk_index = BulkIndex(index, http=fake_http)
+
+    count = bulk_index.set_document_fields(["d1"], {"title_txt_en": "new"})
+
+    assert count == 2
+    assert fake_http.gets[0][1]["q"] == 'document_id:("d1")'
+    docs = json.loads(fake_http.requests[0][0])
+    assert [doc["title_txt_en"] for doc in docs] == [{"set": "new"}] * 2
+
+
+def test_remove_sends_ids_in_chunks(index, fake_http):
+    bulk_index = BulkIndex(index, http=fake_http)
+    ids = [f"p{i}" for i in range(2500)]
+
+    count = bulk_index.remove(ids)
+
+    assert count == 2500
+    chunks = [json.loads(body)["delete"] for body, _ in fake_http.requests]
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    assert sum(chunks, []) == ids
+
+
+def test_remove_documents_deletes_by_query(index, fake_http):
+    bulk_index = BulkIndex(index, http=fake_http)
+
+    bulk_index.remove_documents(["d1", "d2"])
+
+    assert fake_http.deleted == [{"query": 'document_id:("d1" OR "d2")'}]
+
+
+def test_remove_documents_in_chunks(index, fake_http):
+    bulk_index = BulkIndex(index, http=fake_http)
+
+    bulk_index.remove_documents([f"d{i}" for i in range(600)])
+
+    queries = [delete["query"] for delete in fake_http.deleted]
+    assert [query.count(" OR ") + 1 for query in queries] == [500, 100]
+
+
+def test_add_skips_unchanged_entities(tmp_path, index, fake_http):
+    store = FingerprintStore(tmp_path / "fingerprints.sqlite3")
+    bulk_index = BulkIndex(index, http=fake_http, fingerprints=store)
+    entities = [
+        IndexEntity(id=f"p{i}", title="doc.pdf", user_id="u1", text="x")
+        for i in range(2)
+    ]
+    bulk_index.add(entities)
+    entities[1].text = "changed"
+
+    assert bulk_index.add(entities) == 1
+    assert fake_http.added == ["p0", "p1", "p1"]
+    # with force, unchanged entities are sent as well
+    assert bulk_index.add(entities, force=True) == 2
+
+
+def test_remove_and_set_fields_drop_fingerprints(tmp_path, index, fake_http):
+    store = FingerprintStore(tmp_path / "fingerprints.sqlite3")
+    bulk_index = BulkIndex(index, http=fake_http, fingerprints=store)
+    bulk_index.add(
+        IndexEntity(id=f"p{i}", title="doc.pdf", user_id="u1", text="x")
+        for i in range(3)
+    )
+
+    bulk_index.remove(["p0"])
+    bulk_index.set_fields([("p1", {"tags": ["one"]})])
+
+    assert list(store.get(["p0", "p1", "p2"])) == ["p2"]
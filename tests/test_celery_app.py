@@ -0,0 +1,17 @@
+from i3worker import constants
+from i3worker.celery_app import app
+from i3worker.config import get_settings
+
+
+def test_bulk_tasks_are_routed_to_bulk_queue():
+    settings = get_settings()
+
+    def queue(name):
+        return app.amqp.router.route({}, name)['queue'].name
+
+    assert queue(constants.INDEX_ADD_DOCS_BULK) == (
+        settings.papermerge__celery__bulk_queue
+    )
+    assert queue(constants.INDEX_ADD_NODE) == (
+        settings.papermerge__celery__interactive_queue
+    )
@@ -0,0 +1,19 @@
+from i3worker.cluster import Collections
+
+
+def test_create_alias(index, fake_http):
+    collections = Collections(index, http=fake_http)
+
+    collections.create_alias("i3", "i3_20240101000000")
+
+    url, params = fake_http.gets[0]
+    assert url == "http://localhost:8983/solr/admin/collections"
+    assert params["action"] == "CREATEALIAS"
+    assert params["name"] == "i3"
+    assert params["collections"] == "i3_20240101000000"
+
+
+def test_aliases(index, fake_http):
+    fake_http.data = {"aliases": {"i3": "i3_1"}}
+
+    assert Collections(index, http=fake_http).aliases() == {"i3": "i3_1"}
@@ -0,0 +1,148 @@
+import uuid
+
+import fakeredis
+import pytest
+import requests
+
+from i3worker import tasks
+from i3worker.coalesce import NODES, PAGES, VERSIONS, IndexBuffer
+from i3worker.db.orm import DocumentVersion, Page
+
+
+@pytest.fixture()
+def buffer(monkeypatch):
+    buffer = IndexBuffer(fakeredis.FakeRedis(), window=1, max_batch=100)
+    monkeypatch.setattr(tasks, "get_buffer", lambda: buffer)
+    # flush is called by the tests
+    monkeypatch.setattr(
+        tasks.flush_index_buffer, "apply_async", lambda *a, **kw: None
+    )
+    return buffer
+
+
+def add_version(session, doc_id, number: int, page_count: int = 2):
+    ver_id = uuid.uuid4()
+    session.add(
+        DocumentVersion(
+            id=ver_id,
+            number=number,
+            file_name="doc.pdf",
+            document_id=doc_id
+        )
+    )
+    page_ids = []
+    for page_number in range(1, page_count + 1):
+        page_ids.append(uuid.uuid4())
+        session.add(
+            Page(
+                id=page_ids[-1],
+                number=page_number,
+                text=f"v{number}",
+                document_version_id=ver_id
+            )
+        )
+    session.commit()
+
+    return str(ver_id), {str(page_id) for page_id in page_ids}
+
+
+def test_push_deduplicates_and_schedules_one_flush():
+    buffer = IndexBuffer(fakeredis.FakeRedis(), window=1, max_batch=100)
+
+    assert buffer.push(PAGES, ["p1", "p2"]) is True
+    assert buffer.push(PAGES, ["p2", "p3"]) is False
+
+    items = buffer.pop()
+    assert sorted(items[PAGES]) == ["p1", "p2", "p3"]
+    assert items[NODES] == [] and items[VERSIONS] == []
+    # buffer is empty and next push schedules new flush
+    assert buffer.pending() is False
+    assert buffer.push(NODES, ["n1"]) is True
+
+
+def test_pop_returns_at_most_max_batch():
+    buffer = IndexBuffer(fakeredis.FakeRedis(), window=1, max_batch=2)
+    buffer.push(PAGES, ["p1", "p2", "p3"])
+
+    assert len(buffer.pop()[PAGES]) == 2
+    assert buffer.pending() is True
+
+
+def test_restore():
+    buffer = IndexBuffer(fakeredis.FakeRedis(), window=1, max_batch=100)
+    buffer.push(PAGES, ["p1"])
+    items = buffer.pop()
+
+    buffer.restore(items)
+
+    assert buffer.pop()[PAGES] == ["p1"]
+
+
+def test_flush_sends_each_entity_once(
+    session, doc_factory, buffer, bulk_index, fake_http
+):
+    doc = doc_factory(title="doc.pdf", page_count=2)
+
+    tasks.index_add_node(str(doc.id))
+    tasks.index_add_node(str(doc.id))
+    tasks.flush_index_buffer()
+
+    assert len(fake_http.added) == 2
+    assert len(set(fake_http.added)) == 2
+    assert buffer.pending() is False
+
+
+def test_flush_of_replaced_versions(
+    session, doc_factory, buffer, bulk_index, fake_http
+):
+    """Version replaced by newer one within the same window should
+    be removed from the index, not added"""
+    doc = doc_factory(title="doc.pdf", page_count=0)
+    ver_a, pages_a = add_version(session, doc.id, number=2)
+    ver_b, pages_b = add_version(session, doc.id, number=3)
+    ver_c, pages_c = add_version(session, doc.id, number=4)
+
+    tasks.add_pages_to_index(list(pages_b))
+    tasks.update_index(ver_b, ver_a)
+    tasks.update_index(ver_c, ver_b)
+    tasks.flush_index_buffer()
+
+    assert set(fake_http.added) == pages_c
+    assert set(fake_http.deleted) == pages_a | pages_b
+
+
+def test_flush_restores_buffer_on_failure(
+    session, doc_factory, buffer, bulk_index, fake_http
+):
+    fake_http.error = requests.ConnectionError()
+    doc = doc_factory(title="doc.pdf", page_count=2)
+    tasks.index_add_node(str(doc.id))
+
+    with pytest.raises(requests.ConnectionError):
+        tasks.flush_index_buffer()
+
+    assert buffer.pop()[NODES] == [str(doc.id)]
+
+
+def test_invalid_id_is_not_buffered(buffer):
+    with pytest.raises(ValueError):
+        tasks.index_add_node("not-a-uuid")
+    with pytest.raises(ValueError):
+        tasks.update_index(str(uuid.uuid4()), "not-a-uuid")
+
+    assert buffer.pending() is False
+
+
+def test_flush_drops_buffer_on_permanent_failure(
+    session, doc_factory, buffer, bulk_index, fake_http
+):
+    """IDs of failed flush should not block later flushes, unless
+    the error is temporary"""
+    fake_http.error = requests.HTTPError("400")
+    doc = doc_factory(title="doc.pdf", page_count=2)
+    tasks.index_add_node(str(doc.id))
+
+    with pytest.raises(requests.HTTPError):
+        tasks.flush_index_buffer()
+
+    assert buffer.pending() is False
@@ -0,0 +1,39 @@
+import gzip
+import json
+
+from i3worker.export import NDJSONWriter
+from i3worker.index import IndexEntity
+
+
+def entities(count: int):
+    return [
+        IndexEntity(id=f"p{i}", title="doc.pdf", user_id="u1", text="x" * 100)
+        for i in range(count)
+    ]
+
+
+def test_writer_splits_in_parts(tmp_path):
+    writer = NDJSONWriter(tmp_path / "export.ndjson", max_bytes=500)
+    with writer:
+        writer.write(entities(5))
+
+    assert writer.count == 5
+    assert len(writer.paths) > 1
+    assert writer.paths[0].name == "export-00001.ndjson"
+    lines = [
+        json.loads(line)
+        for path in writer.paths
+        for line in path.read_text().splitlines()
+    ]
+    assert [line["id"] for line in lines] == [f"p{i}" for i in range(5)]
+    assert lines[0]["title_txt_en"] == "doc.pdf"
+    assert all(path.stat().st_size <= 500 for path in writer.paths)
+
+
+def test_writer_gzip(tmp_path):
+    with NDJSONWriter(tmp_path / "export.ndjson", compress=True) as writer:
+        writer.write(entities(3))
+
+    assert [path.name for path in writer.paths] == ["export.ndjson.gz"]
+    with gzip.open(writer.paths[0], "rt") as f:
+        assert len(f.readlines()) == 3
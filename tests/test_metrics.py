@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, text
+
+from i3worker import metrics
+from i3worker.config import get_settings
+
+
+def test_render_histogram():
+    histogram = metrics.Histogram(
+        "test_duration_seconds",
+        "Test duration",
+        labels=("task",),
+        buckets=(0.1, 1),
+    )
+    histogram.observe(0.05, task="a")
+    histogram.observe(0.5, task="a")
+    histogram.observe(5, task="a")
+    registry = metrics.Registry()
+    registry.register(histogram)
+
+    lines = registry.render({"pid": 1}).splitlines()
+
+    assert lines[1] == "# TYPE test_duration_seconds histogram"
+    assert 'test_duration_seconds_bucket{task="a",pid="1",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{task="a",pid="1",le="1"} 2' in lines
+    assert 'test_duration_seconds_bucket{task="a",pid="1",le="+Inf"} 3' in lines
+    assert 'test_duration_seconds_count{task="a",pid="1"} 3' in lines
+    assert 'test_duration_seconds_sum{task="a",pid="1"} 5.55' in lines
+
+
+def test_instrument_engine():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    before = metrics.db_queries.values.get(("SELECT",), 0)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert metrics.db_queries.values[("SELECT",)] == before + 1
+
+
+def test_textfile_of_pool_process_is_named_after_its_slot(
+    tmp_path, monkeypatch
+):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "papermerge__metrics__port", None)
+    monkeypatch.setattr(
+        settings, "papermerge__metrics__textfile_dir", tmp_path
+    )
+    monkeypatch.setattr(
+        metrics, "current_process", lambda: SimpleNamespace(index=2)
+    )
+
+    metrics.start_exporter()
+    path = tmp_path / "i3worker-2.prom"
+    assert path.exists()
+
+    metrics.stop_exporter()
+    assert not path.exists()
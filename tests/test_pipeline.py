@@ -0,0 +1,95 @@
+import threading
+import time
+from contextlib import nullcontext
+
+import pytest
+
+from i3worker.pipeline import IndexPipeline, Pipeline, Stage
+
+
+class FakeBulkIndex:
+    """Sends batches with delay; later chunks are sent faster"""
+    def __init__(self, fail_on=None):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_on = fail_on
+        self.defer_commit = False
+        self.commits = []
+
+    def batches(self, entities, force=False):
+        return [entities] if entities else []
+
+    def send(self, batch, commit=True):
+        self.commits.append(commit)
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05 / (batch[0] + 1))
+        with self.lock:
+            self.in_flight -= 1
+        if batch[0] == self.fail_on:
+            raise ValueError("boom")
+
+    def remember(self, batch):
+        pass
+
+    def commit(self):
+        self.commits.append("commit")
+
+
+def chunks(count):
+    for i in range(count):
+        yield f"key{i}", [i]
+
+
+def convert(db_session, nodes):
+    return nodes
+
+
+def test_pipeline_stats():
+    def double(_, item):
+        yield item * 2
+
+    pipeline = Pipeline(
+        range(10),
+        [Stage("double", double, workers=3)],
+        queue_size=2
+    )
+
+    assert sorted(pipeline.run()) == [i * 2 for i in range(10)]
+    assert [stats.items for stats in pipeline.stats] == [10, 10]
+
+
+def test_index_pipeline_reports_chunks_in_order():
+    bulk_index = FakeBulkIndex()
+    done = []
+    pipeline = IndexPipeline(
+        bulk_index,
+        convert=convert,
+        session_factory=nullcontext,
+        converters=2,
+        writers=4
+    )
+
+    count = pipeline.add(chunks(8), on_chunk_done=done.append)
+
+    assert count == 8
+    assert bulk_index.max_in_flight > 1
+    assert done == [f"key{i}" for i in range(8)]
+    assert bulk_index.commits == [False] * 8 + ["commit"]
+    assert [stats.name for stats in pipeline.stats] == [
+        "read", "convert", "batch", "write"
+    ]
+
+
+def test_index_pipeline_raises_stage_error():
+    pipeline = IndexPipeline(
+        FakeBulkIndex(fail_on=3),
+        convert=convert,
+        session_factory=nullcontext,
+        writers=4
+    )
+
+    with pytest.raises(ValueError):
+        pipeline.add(chunks(8))
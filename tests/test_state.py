@@ -0,0 +1,38 @@
+import uuid
+from datetime import datetime
+
+from i3worker.state import IndexState
+
+
+def test_checkpoints_are_kept_per_range(tmp_path):
+    state = IndexState(tmp_path)
+    until_id = uuid.uuid4()
+    last_id = uuid.uuid4()
+
+    state.start_run(datetime(2024, 1, 1), since=None)
+    state.save_checkpoint(None, until_id, last_id)
+
+    assert state.get_checkpoint(None, until_id) == last_id
+    assert state.get_checkpoint(until_id, None) is None
+
+
+def test_finish_run_moves_watermark(tmp_path):
+    state = IndexState(tmp_path)
+    state.start_run(datetime(2024, 1, 1), since=None)
+    state.save_checkpoint(None, None, uuid.uuid4())
+
+    state.finish_run()
+
+    assert state.get_watermark() == datetime(2024, 1, 1)
+    assert state.get_run() is None
+    assert state.get_checkpoint(None, None) is None
+
+
+def test_finish_run_keeps_watermark_if_nodes_were_skipped(tmp_path):
+    state = IndexState(tmp_path)
+    state.set_watermark(datetime(2024, 1, 1))
+    state.start_run(datetime(2024, 3, 1), since=datetime(2024, 2, 1))
+
+    state.finish_run()
+
+    assert state.get_watermark() == datetime(2024, 1, 1)
@@ -1,7 +1,18 @@
+import json
+import uuid
+
 from sqlalchemy import select
-from i3worker import db
-from i3worker.db.models import Node
-from i3worker.tasks import from_folder, from_document, from_page
+from i3worker.db import api
+from i3worker import tasks
+from i3worker.bulk import to_doc
+from i3worker.celery_app import app
+from i3worker.db.orm import (
+    DocumentVersion, Node, NodeTagsAssociation, Page, Tag
+)
+from i3worker.index import IndexEntity
+from i3worker.tasks import (
+    from_folder, from_document, from_documents, from_page, from_pages
+)
 
 
 def test_from_folder(session, folder_factory):
@@ -38,10 +49,195 @@ def test_from_page(session, page_factory):
     assert index_entity.title == "My Receipt"
 
 
+def test_from_pages(session, page_factory):
+    """`from_pages` should return index entities in order of given ids"""
+    page1 = page_factory(title="First", text="one")
+    page2 = page_factory(title="Second", text="two")
+
+    index_entities = from_pages(session, [page2.id, page1.id])
+
+    assert [e.title for e in index_entities] == ["Second", "First"]
+    assert [e.text for e in index_entities] == ["two", "one"]
+
+
+def test_from_documents_entities_are_valid(session, doc_factory):
+    """Entities built without validation should be sent exactly as
+    validated ones would be"""
+    doc = doc_factory(title="receipt_001.pdf", page_count=2)
+
+    index_entities = from_documents(session, [api.get_doc(session, doc.id)])
+
+    assert [e.page_number for e in index_entities] == [1, 2]
+    for entity in index_entities:
+        validated = IndexEntity.model_validate(entity.model_dump())
+        assert to_doc(entity) == to_doc(validated)
+
+
+def test_page_tags_are_sorted_on_all_paths(session, doc_factory):
+    """Page should be encoded the same (with sorted tags) no matter
+    whether it was loaded by document or by page ID"""
+    doc = doc_factory(title="receipt_001.pdf", page_count=1)
+    for index, name in enumerate(["zeta", "alpha", "mu"]):
+        tag_id = uuid.uuid4()
+        session.add(Tag(id=tag_id, name=name))
+        session.add(
+            NodeTagsAssociation(id=index + 1, node_id=doc.id, tag_id=tag_id)
+        )
+    session.commit()
+
+    [by_doc] = from_documents(session, [api.get_doc(session, doc.id)])
+    [by_page] = from_pages(session, [uuid.UUID(by_doc.id)])
+
+    assert by_doc.tags == ["alpha", "mu", "zeta"]
+    assert to_doc(by_doc) == to_doc(by_page)
+
+
 def test_get_node_with_tags(session, folder_factory):
     """`get_node` should return correctly node/folder with tags"""
 
     folder = folder_factory(title="My Folder", tags=["one", "two"])
-    node = db.get_node(session, folder.id)
-
-    assert set(node.tags) == {'one', 'two'}
+    node = api.get_node(session, folder.id)
+
+    assert {tag.name for tag in node.tags} == {'one', 'two'}
+
+
+def test_index_add_docs_splits_long_lists(monkeypatch):
+    """`index_add_docs` should index long lists of documents in chunks"""
+    added = []
+
+    def add_docs(doc_ids):
+        added.append(doc_ids)
+        return len(doc_ids)
+
+    monkeypatch.setattr(tasks, "_add_docs", add_docs)
+    monkeypatch.setattr(tasks.settings, "papermerge__celery__chunk_size", 2)
+    monkeypatch.setitem(app.conf, "task_always_eager", True)
+
+    tasks.index_add_docs(["d1", "d2", "d3"])
+
+    assert added == [["d1", "d2"], ["d3"]]
+
+
+def test_remove_docs_from_index(bulk_index, fake_http):
+    tasks.remove_docs_from_index(["d1", "d2"])
+
+    assert fake_http.deleted == [{"query": 'document_id:("d1" OR "d2")'}]
+    assert fake_http.requests[0][1]["commit"] == "true"
+
+
+def tag_node(session, node_id, names, tag_ids=None):
+    """Attaches tags with given names to the node, creating the tags
+    unless found by name in `tag_ids`"""
+    tag_ids = {} if tag_ids is None else tag_ids
+    for name in names:
+        if name not in tag_ids:
+            tag_ids[name] = uuid.uuid4()
+            session.add(Tag(id=tag_ids[name], name=name))
+        session.add(
+            NodeTagsAssociation(
+                id=session.query(NodeTagsAssociation).count() + 1,
+                node_id=node_id,
+                tag_id=tag_ids[name]
+            )
+        )
+        session.flush()
+    session.commit()
+    return tag_ids
+
+
+def sent_tags(fake_http) -> dict[str, list[str]]:
+    """Returns `tags` set by atomic updates, keyed by entity ID"""
+    result = {}
+    for body, _ in fake_http.requests:
+        for doc in json.loads(body):
+            result[doc["id"]] = doc["tags"]["set"]
+    return result
+
+
+def add_last_version(session, doc) -> list[str]:
+    ver_id = uuid.uuid4()
+    session.add(
+        DocumentVersion(
+            id=ver_id, number=2, file_name="doc.pdf", document_id=doc.id
+        )
+    )
+    page_ids = [uuid.uuid4(), uuid.uuid4()]
+    for number, page_id in enumerate(page_ids, start=1):
+        session.add(
+            Page(id=page_id, number=number, document_version_id=ver_id)
+        )
+    session.commit()
+    return [str(page_id) for page_id in page_ids]
+
+
+def test_update_tags(
+    session, folder_factory, doc_factory, bulk_index, fake_http
+):
+    """Sorted tags should be set on the folder and on the pages of
+    document's last version"""
+    folder = folder_factory(title="My Folder")
+    doc = doc_factory(title="receipt_001.pdf", page_count=2)
+    page_ids = add_last_version(session, doc)
+    tag_ids = tag_node(session, folder.id, ["zeta", "alpha"])
+    tag_node(session, doc.id, ["mu", "alpha"], tag_ids)
+
+    tasks.update_tags([str(folder.id), str(doc.id)])
+
+    assert sent_tags(fake_http) == {
+        str(folder.id): ["alpha", "zeta"],
+        page_ids[0]: ["alpha", "mu"],
+        page_ids[1]: ["alpha", "mu"],
+    }
+
+
+def test_rename_tag(
+    session, folder_factory, doc_factory, bulk_index, fake_http
+):
+    """Nodes tagged with renamed tag should get their tags updated"""
+    folder = folder_factory(title="My Folder")
+    doc = doc_factory(title="receipt_001.pdf", page_count=1)
+    page_ids = add_last_version(session, doc)
+    untagged = folder_factory(title="Other")
+    tag_ids = tag_node(session, folder.id, ["beta", "gamma"])
+    tag_node(session, doc.id, ["beta"], tag_ids)
+    session.get(Tag, tag_ids["beta"]).name = "zulu"
+    session.commit()
+
+    tasks.rename_tag(str(tag_ids["beta"]))
+
+    # untagged folder is not updated
+    assert sent_tags(fake_http) == {
+        str(folder.id): ["gamma", "zulu"],
+        page_ids[0]: ["zulu"],
+        page_ids[1]: ["zulu"],
+    }
+
+
+def test_rename_folder(session, folder_factory, bulk_index, fake_http):
+    folder = folder_factory(title="New Title")
+
+    tasks.rename_node(str(folder.id))
+
+    assert fake_http.gets == []
+    [doc] = json.loads(fake_http.requests[0][0])
+    assert doc["id"] == str(folder.id)
+    assert doc["title_txt_en"] == {"set": "New Title"}
+
+
+def test_rename_document(session, doc_factory, bulk_index, fake_http):
+    """Title should be set on the pages found in the index by
+    document ID"""
+    doc = doc_factory(title="new.pdf", page_count=2)
+    fake_http.data = {
+        "response": {"docs": [{"id": "p1"}, {"id": "p2"}]},
+        "nextCursorMark": "next"
+    }
+
+    tasks.rename_node(str(doc.id))
+
+    assert fake_http.gets[0][1]["q"] == f'document_id:("{doc.id}")'
+    pages = json.loads(fake_http.requests[0][0])
+    assert {page["id"]: page["title_txt_en"] for page in pages} == {
+        "p1": {"set": "new.pdf"},
+        "p2": {"set": "new.pdf"},
+    }
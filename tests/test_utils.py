@@ -0,0 +1,19 @@
+import uuid
+
+from i3worker.utils import chunked, uuid_ranges
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_uuid_ranges_cover_uuid_space():
+    ranges = uuid_ranges(4)
+
+    assert len(ranges) == 4
+    assert ranges[0][0] is None
+    assert ranges[-1][1] is None
+    # each range starts where the previous one ends
+    for (_, until_id), (after_id, _) in zip(ranges[:-1], ranges[1:]):
+        assert until_id == after_id
+    assert ranges[1][0] == uuid.UUID("40000000-0000-0000-0000-000000000000")
@@ -0,0 +1,48 @@
+import pytest
+
+from i3worker import constants
+from i3worker.index import FOLDER, PAGE
+from i3worker.verify import (
+    MISSING,
+    ORPHANED,
+    Difference,
+    Repair,
+    db_entries,
+    diff,
+)
+
+
+def test_diff_reports_missing_and_orphaned():
+    entries = db_entries(iter(["a", "d"]), iter(["b", "c"]))
+    index_ids = iter(["b", "c2", "d"])
+
+    result = list(diff(entries, index_ids))
+
+    assert result == [
+        Difference(MISSING, "a", FOLDER),
+        Difference(MISSING, "c", PAGE),
+        Difference(ORPHANED, "c2", None),
+    ]
+
+
+def test_diff_rejects_unsorted_ids():
+    with pytest.raises(ValueError):
+        list(diff(iter([("b", PAGE), ("a", PAGE)]), iter([])))
+
+
+def test_repair_sends_tasks_in_chunks():
+    sent = []
+    repair = Repair(lambda name, args: sent.append((name, args)), chunk_size=2)
+
+    for page_id in ["p1", "p2", "p3"]:
+        repair.push(Difference(MISSING, page_id, PAGE))
+    repair.push(Difference(MISSING, "f1", FOLDER))
+    repair.push(Difference(ORPHANED, "o1", None))
+    repair.flush()
+
+    assert sent == [
+        (constants.INDEX_ADD_PAGES_BULK, [["p1", "p2"]]),
+        (constants.INDEX_ADD_NODE, ["f1"]),
+        (constants.INDEX_ADD_PAGES_BULK, [["p3"]]),
+        (constants.INDEX_REMOVE_NODE, [["o1"]]),
+    ]